@@ -1,4 +1,8 @@
 from . import db_discogs
+from . import discogs_artwork
+from . import discogs_dump_importer
+from . import discogs_file_importer
+from . import discogs_http
 from . import discogs_importer
 from . import discogs_oauth_gui
 
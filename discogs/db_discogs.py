@@ -1,10 +1,21 @@
-from shared.db import context_manager, get_connection, row_change, row_ignore_change
+from shared.db import context_manager, row_change, row_ignore_change
+from shared.utils import earliest_date
 
 import logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
+# State of the last download of a release's artwork, in image_status
+IMAGE_PENDING = 'pending'
+IMAGE_SAVED = 'saved'
+IMAGE_FAILED = 'failed'
+# Downloaded, but it cannot be decoded, so it gets no thumbnails until its artwork changes
+IMAGE_UNREADABLE = 'unreadable'
+
+# Columns compared and updated by upsert_release, in the order changes are reported
+RELEASE_FIELDS = ('artist', 'title', 'format', 'country', 'barcodes', 'catnos', 'year', 'master_id')
+
 
 def update_field_if_changed(db_path, discogs_id, field_name, new_value, callback=print):
     with context_manager(db_path) as cur:
@@ -59,6 +70,29 @@ def set_master_id(db_path, discogs_id, new_value, callback=print):
     update_field_if_changed(db_path, discogs_id, 'master_id', new_value, callback)
 
 
+def release_date_should_change(discogs_id, old_value, new_value, release_date_locked, force=False):
+    """Decide whether a stored release date may be replaced by a new one"""
+    if release_date_locked and not force:
+        logger.info(f"Release date locked for discogs_id {discogs_id}, skipping update.")
+        return False
+
+    if old_value == new_value:
+        return False
+
+    if not force:
+        if old_value is not None and (new_value is None or len(new_value) < len(old_value)):
+            logger.debug(row_ignore_change(
+                discogs_id, 'release_date', new_value, old_value, "shorter"))
+            return False
+
+        if old_value is not None and (old_value < new_value and len(old_value) >= len(new_value)):
+            logger.debug(row_ignore_change(
+                discogs_id, 'release_date', new_value, old_value, "newer"))
+            return False
+
+    return True
+
+
 def set_release_date(db_path, discogs_id, new_value, force=False, callback=print):
     with context_manager(db_path) as cur:
         cur.execute("""
@@ -69,26 +103,10 @@ def set_release_date(db_path, discogs_id, new_value, force=False, callback=print
         if not row:
             raise Exception('Unexpected row not found error')
         old_value = row.release_date
-        release_date_locked = row.release_date_locked
 
-        if release_date_locked and not force:
-            logger.info(f"Release date locked for discogs_id {discogs_id}, skipping update.")
-            return
-
-        if old_value == new_value:
+        if not release_date_should_change(discogs_id, old_value, new_value, row.release_date_locked, force):
             return
 
-        if not force:
-            if old_value is not None and (new_value is None or len(new_value) < len(old_value)):
-                logger.debug(row_ignore_change(
-                    discogs_id, 'release_date', new_value, old_value, "shorter"))
-                return
-
-            if old_value is not None and (old_value < new_value and len(old_value) >= len(new_value)):
-                logger.debug(row_ignore_change(
-                    discogs_id, 'release_date', new_value, old_value, "newer"))
-                return
-
         callback(row_change(discogs_id, 'release_date', new_value, old_value))
 
         cur.execute("""
@@ -122,6 +140,96 @@ def insert_row(
         """, (discogs_id, artist, title, country, format, year, barcodes, catnos, release_date, sort_name, master_id))
 
 
+def upsert_release(db_path, discogs_id, release, callback=print):
+    """Insert or update a release from a normalized record
+
+    release is a dict keyed by column name. The stored row is read once and
+    compared in memory, and only the changed columns are written in a single
+    UPDATE, following the same rules as the set_* helpers. Returns the row as
+    it was before the update, or None if the release was inserted."""
+
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            SELECT *
+            FROM discogs_releases
+            WHERE discogs_id = ?""", (discogs_id,))
+        row = cur.fetchone()
+
+        if not row:
+            cur.execute("""
+                INSERT INTO discogs_releases (discogs_id, artist, title, country, format, year, barcodes, catnos, release_date, sort_name, master_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (discogs_id, release.get('artist'), release.get('title'), release.get('country'),
+                  release.get('format'), release.get('year'), release.get('barcodes'), release.get('catnos'),
+                  release.get('release_date'), release.get('sort_name') or release.get('artist'),
+                  release.get('master_id')))
+            return None
+
+        changes = {}
+        for field_name in RELEASE_FIELDS:
+            if field_name in release and getattr(row, field_name) != release[field_name]:
+                changes[field_name] = release[field_name]
+
+        if 'release_date' in release:
+            release_date = earliest_date(row.release_date, release['release_date'])
+            if release_date_should_change(discogs_id, row.release_date, release_date, row.release_date_locked):
+                changes['release_date'] = release_date
+
+        if not row.sort_name and release.get('artist'):
+            changes['sort_name'] = release['artist']
+
+        if not changes:
+            return row
+
+        for field_name, new_value in changes.items():
+            callback(row_change(discogs_id, field_name, new_value, getattr(row, field_name)))
+
+        assignments = ', '.join(f'{field_name} = ?' for field_name in changes)
+        cur.execute(f"""
+            UPDATE discogs_releases
+            SET {assignments}
+            WHERE discogs_id = ? """, (*changes.values(), discogs_id))
+
+    return row
+
+
+def upsert_releases(db_path, releases, replace=True):
+    """Insert or update many releases from normalized records in one statement
+
+    releases is an iterable of dicts keyed by column name, as for
+    upsert_release, and is written with executemany. A value that is None
+    never replaces a stored one. With replace False, stored values are kept
+    and only the missing ones are filled in. A stored release date is only
+    replaced by a more precise form of the same date, and never if it is
+    locked. Rows whose values would not change are not updated, so their
+    updated_at is left alone. Returns the number of rows inserted or changed."""
+
+    if replace:
+        values = {field_name: f'COALESCE(excluded.{field_name}, {field_name})' for field_name in RELEASE_FIELDS}
+    else:
+        values = {field_name: f'COALESCE({field_name}, excluded.{field_name})' for field_name in RELEASE_FIELDS}
+    values['release_date'] = """CASE
+        WHEN release_date IS NULL THEN excluded.release_date
+        WHEN NOT release_date_locked AND excluded.release_date LIKE release_date || '-%' THEN excluded.release_date
+        ELSE release_date END"""
+    values['sort_name'] = "COALESCE(NULLIF(sort_name, ''), excluded.sort_name)"
+
+    assignments = ', '.join(f'{field_name} = {value}' for field_name, value in values.items())
+    changed = ' OR '.join(f'{field_name} IS NOT {value}' for field_name, value in values.items())
+
+    with context_manager(db_path) as cur:
+        cur.executemany(f"""
+            INSERT INTO discogs_releases (discogs_id, artist, title, country, format, year, barcodes, catnos, release_date, sort_name, master_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(discogs_id) DO UPDATE SET {assignments}
+            WHERE {changed}
+        """, ((release['discogs_id'], release.get('artist'), release.get('title'), release.get('country'),
+               release.get('format'), release.get('year'), release.get('barcodes'), release.get('catnos'),
+               release.get('release_date'), release.get('sort_name') or release.get('artist'),
+               release.get('master_id')) for release in releases))
+        return cur.rowcount
+
+
 def fetch_row(db_path, discogs_id):
 
     with context_manager(db_path) as cur:
@@ -150,19 +258,18 @@ def fetch_discogs_release_rows(db_path, where=None):
 
 
 def fetch_unmatched_discogs_release_rows(db_path):
-    conn = get_connection(db_path)
-    cursor = conn.cursor()
 
-    query = []
-    query.append('SELECT d.*')
-    query.append('FROM discogs_releases d')
-    query.append('LEFT JOIN mb_matches m USING(discogs_id)')
-    query.append('WHERE m.mbid IS NULL')
-    query.append('ORDER BY d.discogs_id')
-    cursor.execute(' '.join(query))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with context_manager(db_path) as cur:
+
+        query = []
+        query.append('SELECT d.*')
+        query.append('FROM discogs_releases d')
+        query.append('LEFT JOIN mb_matches m USING(discogs_id)')
+        query.append('WHERE m.mbid IS NULL')
+        query.append('ORDER BY d.discogs_id')
+        cur.execute(' '.join(query))
+
+        return cur.fetchall()
 
 
 def fetch_row_by_discogs_id(db_path, discogs_id):
@@ -201,6 +308,110 @@ def get_all_discogs_ids(db_path):
         return [row[0] for row in cur.fetchall()]
 
 
+def get_all_master_ids(db_path):
+    """Return the distinct master_id values referenced by the releases table"""
+    with context_manager(db_path) as cur:
+        cur.execute("SELECT DISTINCT master_id FROM discogs_releases WHERE master_id")
+        return [row[0] for row in cur.fetchall()]
+
+
+def get_discogs_fingerprints(db_path):
+    """Return the listing fingerprint each release was last imported from, by discogs_id
+
+    Releases whose artwork failed or never finished downloading are left out,
+    so that the next import fetches them, and their artwork, again."""
+    with context_manager(db_path, namedtuple=False) as cur:
+        cur.execute("""
+            SELECT discogs_id, discogs_fingerprint
+            FROM discogs_releases
+            WHERE discogs_fingerprint IS NOT NULL
+            AND (image_status IS NULL OR image_status IN (?, ?))""", (IMAGE_SAVED, IMAGE_UNREADABLE))
+        return dict(cur.fetchall())
+
+
+def set_discogs_fingerprint(db_path, discogs_id, fingerprint):
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            UPDATE discogs_releases
+            SET discogs_fingerprint = ?
+            WHERE discogs_id = ? """, (fingerprint, discogs_id))
+
+
+def set_image_status(db_path, discogs_id, status):
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            UPDATE discogs_releases
+            SET image_status = ?
+            WHERE discogs_id = ? """, (status, discogs_id))
+
+
+def get_image_status_ids(db_path, status):
+    """Return the set of discogs_ids whose artwork is in the given image_status"""
+    with context_manager(db_path, namedtuple=False) as cur:
+        cur.execute("SELECT discogs_id FROM discogs_releases WHERE image_status = ?", (status,))
+        return {row[0] for row in cur.fetchall()}
+
+
+def get_unfinished_import_run(db_path):
+    """Return the latest import run that stopped before it finished, or None"""
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            SELECT run_id, total, page, position
+            FROM discogs_import_runs
+            WHERE finished_at IS NULL
+            ORDER BY run_id DESC
+            LIMIT 1""")
+        return cur.fetchone()
+
+
+def start_import_run(db_path, total):
+    """Record a new import run, abandoning any unfinished ones, and return its run_id"""
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            DELETE FROM discogs_import_run_releases
+            WHERE run_id IN (SELECT run_id FROM discogs_import_runs WHERE finished_at IS NULL)""")
+        cur.execute("DELETE FROM discogs_import_runs WHERE finished_at IS NULL")
+        cur.execute("INSERT INTO discogs_import_runs (total) VALUES (?)", (total,))
+        return cur.lastrowid
+
+
+def get_import_run_releases(db_path, run_id):
+    """Return the set of discogs_ids an import run has imported, with their artwork"""
+    with context_manager(db_path, namedtuple=False) as cur:
+        cur.execute("""
+            SELECT r.discogs_id
+            FROM discogs_import_run_releases r
+            JOIN discogs_releases d USING(discogs_id)
+            WHERE r.run_id = ?
+            AND (d.image_status IS NULL OR d.image_status IN (?, ?))""", (run_id, IMAGE_SAVED, IMAGE_UNREADABLE))
+        return {row[0] for row in cur.fetchall()}
+
+
+def add_import_run_release(db_path, run_id, discogs_id):
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            INSERT OR IGNORE INTO discogs_import_run_releases (run_id, discogs_id)
+            VALUES (?, ?)""", (run_id, discogs_id))
+
+
+def set_import_run_position(db_path, run_id, page, position):
+    with context_manager(db_path) as cur:
+        cur.execute("""
+            UPDATE discogs_import_runs
+            SET page = ?, position = ?
+            WHERE run_id = ?""", (page, position, run_id))
+
+
+def finish_import_run(db_path, run_id):
+    """Mark an import run finished and drop its list of imported releases"""
+    with context_manager(db_path) as cur:
+        cur.execute("DELETE FROM discogs_import_run_releases WHERE run_id = ?", (run_id,))
+        cur.execute("""
+            UPDATE discogs_import_runs
+            SET finished_at = CURRENT_TIMESTAMP
+            WHERE run_id = ?""", (run_id,))
+
+
 def fetch_all_rows(db_path):
     """Return all rows from discogs_releases."""
     with context_manager(db_path) as cur:
@@ -0,0 +1,98 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared import images
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+# Artwork downloads in flight at once during an import
+ARTWORK_WORKERS = 4
+ARTWORK_CHUNK_SIZE = 64 * 1024
+
+
+class ArtworkDownloader:
+    """Downloads release artwork on a pool of threads sharing one HTTP session
+
+    submit() queues a download, which streams the image to a temporary file
+    and renames it into place, so the images folder never holds a partial
+    file. Nothing is written to the database here: completed() and wait()
+    hand the outcomes back to the importing thread as
+    (discogs_id, url, error) tuples, with error None on success. Leaving the
+    with block drops the downloads that have not started."""
+
+    def __init__(self, images_folder, user_agent, max_workers=ARTWORK_WORKERS, timeout=10, attempts=2):
+        self.images_folder = images_folder
+        self.timeout = timeout
+        self.attempts = attempts
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='artwork')
+        self._futures = []
+
+    def submit(self, discogs_id, url):
+        self._futures.append(self._executor.submit(self._download, discogs_id, url))
+
+    def _download(self, discogs_id, url):
+        target = images.image_path(self.images_folder, discogs_id)
+        temp_path = f"{target}.tmp"
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    with open(temp_path, "wb") as f:
+                        for chunk in response.iter_content(ARTWORK_CHUNK_SIZE):
+                            f.write(chunk)
+                os.replace(temp_path, target)
+                return discogs_id, url, None
+            except (requests.RequestException, OSError) as e:
+                error = e
+                logger.debug(f"Artwork download for {discogs_id} failed (attempt {attempt}/{self.attempts}): {e}")
+                if attempt < self.attempts:
+                    time.sleep(attempt)
+
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return discogs_id, url, error
+
+    def completed(self):
+        """Return the outcomes of the downloads that have finished since the last call"""
+        # Each future is looked at once, as a download can finish at any moment
+        done = []
+        pending = []
+        for future in self._futures:
+            (done if future.done() else pending).append(future)
+        self._futures = pending
+        return [future.result() for future in done if not future.cancelled()]
+
+    def wait(self):
+        """Wait for every queued download and return the outcomes not yet collected"""
+        results = [future.result() for future in self._futures]
+        self._futures = []
+        return results
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
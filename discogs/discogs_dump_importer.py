@@ -0,0 +1,274 @@
+import gzip
+import json
+import os
+import xml.etree.ElementTree as ET
+
+from discogs.db_discogs import get_all_discogs_ids, get_all_master_ids, upsert_releases
+from discogs.discogs_file_importer import FILE_IMPORT_BATCH, release_from_payload
+from shared.db import context_manager, thread_connection, transaction
+from shared.config import AppConfig
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+# Records parsed between checks for cancellation and progress updates
+DUMP_PROGRESS_INTERVAL = 10000
+
+# The record element of each kind of dump, by the dump's root element
+DUMP_RECORDS = {
+    'releases': 'release',
+    'masters': 'master',
+    'labels': 'label',
+}
+
+CREATE_DUMP_TABLE = """
+    CREATE TABLE IF NOT EXISTS discogs_dump (
+        kind TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (kind, id)
+    ) WITHOUT ROWID;
+"""
+
+
+class DumpStore:
+    """Lookup store of the records taken from the Discogs data dumps
+
+    Holds the release payloads of the collection, and the masters and labels
+    they reference, as JSON keyed by kind and id. Kept in a database file of
+    its own next to the app's, as it can grow much larger."""
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        # The journal mode cannot be changed inside a transaction
+        thread_connection(store_path).execute("PRAGMA journal_mode=WAL;").fetchone()
+        with context_manager(store_path) as cur:
+            cur.execute(CREATE_DUMP_TABLE)
+
+    def get(self, kind, id):
+        with context_manager(self.store_path) as cur:
+            cur.execute("SELECT data FROM discogs_dump WHERE kind = ? AND id = ?", (kind, id))
+            row = cur.fetchone()
+        return json.loads(row.data) if row else None
+
+    def put_many(self, kind, payloads):
+        with context_manager(self.store_path) as cur:
+            cur.executemany("""
+                INSERT INTO discogs_dump (kind, id, data)
+                VALUES (?, ?, ?)
+                ON CONFLICT(kind, id) DO UPDATE SET data = excluded.data
+            """, ((kind, payload['id'], json.dumps(payload)) for payload in payloads))
+
+    def referenced_ids(self, kind):
+        """Return the ids of the masters or labels referenced by the stored releases"""
+        with context_manager(self.store_path, namedtuple=False) as cur:
+            if kind == 'master':
+                cur.execute("""
+                    SELECT json_extract(data, '$.master_id')
+                    FROM discogs_dump
+                    WHERE kind = 'release'""")
+            else:
+                cur.execute("""
+                    SELECT json_extract(label.value, '$.id')
+                    FROM discogs_dump, json_each(discogs_dump.data, '$.labels') AS label
+                    WHERE kind = 'release'""")
+            return {row[0] for row in cur.fetchall() if row[0]}
+
+
+def open_dump_store(db_path):
+    return DumpStore(os.path.join(os.path.dirname(db_path), 'discogs_dump.db'))
+
+
+def is_dump(path):
+    return path.casefold().endswith(('.xml', '.xml.gz'))
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _artists(elem):
+    return [{'id': _int(artist.findtext('id')), 'name': artist.findtext('name')}
+            for artist in elem.iterfind('artists/artist')]
+
+
+def release_payload(elem):
+    """Return the JSON the Discogs API serves for a release, from its dump element
+
+    Only the fields the importer reads are included. The dumps carry no
+    image URIs, and no year, which is taken from the release date."""
+    released = elem.findtext('released')
+    return {
+        'id': int(elem.get('id')),
+        'title': elem.findtext('title'),
+        'artists': _artists(elem),
+        'labels': [{'id': _int(label.get('id')), 'name': label.get('name'), 'catno': label.get('catno')}
+                   for label in elem.iterfind('labels/label')],
+        'formats': [{'name': format0.get('name'), 'qty': format0.get('qty'),
+                     'descriptions': [description.text for description in format0.iterfind('descriptions/description')]}
+                    for format0 in elem.iterfind('formats/format')],
+        'identifiers': [{'type': identifier.get('type'), 'value': identifier.get('value')}
+                        for identifier in elem.iterfind('identifiers/identifier')],
+        'country': elem.findtext('country'),
+        'released': released,
+        'year': _int((released or '')[:4]) or 0,
+        'master_id': _int(elem.findtext('master_id')),
+    }
+
+
+def master_payload(elem):
+    return {
+        'id': int(elem.get('id')),
+        'main_release': _int(elem.findtext('main_release')),
+        'title': elem.findtext('title'),
+        'year': _int(elem.findtext('year')) or 0,
+        'artists': _artists(elem),
+    }
+
+
+def label_payload(elem):
+    parent = elem.find('parentLabel')
+    return {
+        'id': int(elem.findtext('id')),
+        'name': elem.findtext('name'),
+        'parent_label': {'id': _int(parent.get('id')), 'name': parent.text} if parent is not None else None,
+    }
+
+
+DUMP_PAYLOADS = {
+    'release': release_payload,
+    'master': master_payload,
+    'label': label_payload,
+}
+
+
+def iter_dump(f):
+    """Yield the record elements of a dump, with their id, as (id, element)
+
+    iterparse builds each record as it is read, and the root is cleared
+    after each one, so memory use does not grow with the size of the dump.
+    The element is only valid until the next one is asked for."""
+    depth = 0
+    root = None
+    record = None
+    for event, elem in ET.iterparse(f, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = elem
+                record = DUMP_RECORDS.get(elem.tag)
+                if record is None:
+                    raise ValueError(f"Not a Discogs data dump: <{elem.tag}>")
+            continue
+
+        depth -= 1
+        if depth == 1 and elem.tag == record:
+            # Releases and masters have an id attribute, labels an id element
+            yield _int(elem.get('id') or elem.findtext('id')), elem
+            root.clear()
+
+
+def _open_dump(path):
+    return gzip.open(path, 'rb') if path.casefold().endswith('.gz') else open(path, 'rb')
+
+
+def dump_kind(path):
+    """Return the kind of record in a dump, read from its root element"""
+    with _open_dump(path) as f:
+        for _, elem in ET.iterparse(f, events=('start',)):
+            return DUMP_RECORDS.get(elem.tag)
+
+
+def import_from_dump(cfg: AppConfig, path, callback=print, should_cancel=lambda: False,
+                     progress_callback=lambda pct: None):
+    """Refresh the collection from a Discogs data dump, without the API
+
+    A releases dump updates the releases in the collection, as an import of
+    their payloads would, and keeps the payloads in the lookup store.
+    Masters and labels dumps keep the masters and labels those releases
+    reference. Records outside the collection are parsed and dropped, and
+    the dump, which is sorted by id, is only read until the last wanted
+    record."""
+
+    db_path = cfg.db_path
+    store = open_dump_store(db_path)
+
+    kind = dump_kind(path)
+    if kind == 'release':
+        wanted = set(get_all_discogs_ids(db_path))
+    elif kind == 'master':
+        wanted = set(get_all_master_ids(db_path)) | store.referenced_ids('master')
+    elif kind == 'label':
+        wanted = store.referenced_ids('label')
+    else:
+        callback(f"{os.path.basename(path)} is not a Discogs data dump.")
+        return
+
+    if not wanted:
+        callback(f"No {kind}s in the collection to read from {os.path.basename(path)}.")
+        progress_callback(100)
+        return
+
+    callback(f'Reading {len(wanted)} {kind}s from {os.path.basename(path)}')
+
+    total_bytes = os.path.getsize(path)
+    to_payload = DUMP_PAYLOADS[kind]
+    found = 0
+    changed = 0
+    skipped = 0
+    payloads = []
+
+    def _write(payloads):
+        nonlocal changed, skipped
+        store.put_many(kind, payloads)
+        if kind != 'release':
+            return
+
+        releases = []
+        for payload in payloads:
+            try:
+                releases.append(release_from_payload(payload))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                skipped += 1
+                logger.debug(f"Skipping unreadable release {payload['id']}: {e}")
+        with transaction(db_path):
+            changed += upsert_releases(db_path, releases)
+
+    with open(path, 'rb') as raw:
+        f = gzip.GzipFile(fileobj=raw) if path.casefold().endswith('.gz') else raw
+        for parsed, (id, elem) in enumerate(iter_dump(f), start=1):
+            if id in wanted:
+                wanted.discard(id)
+                found += 1
+                payloads.append(to_payload(elem))
+                if len(payloads) >= FILE_IMPORT_BATCH:
+                    _write(payloads)
+                    payloads = []
+
+            if parsed % DUMP_PROGRESS_INTERVAL == 0:
+                if should_cancel():
+                    callback("Import cancelled.")
+                    return
+                # The compressed bytes read so far
+                progress_callback(int(raw.tell() / total_bytes * 100))
+
+            if not wanted:
+                break
+
+    if payloads:
+        _write(payloads)
+    progress_callback(100)
+
+    if wanted:
+        callback(f"⚠️ {len(wanted)} {kind}s were not found in the dump.")
+    if skipped:
+        callback(f"⚠️ {skipped} releases could not be read and were skipped.")
+    if kind == 'release':
+        callback(f'🏁 {found} releases found, {changed} items updated, {found - skipped - changed} unchanged items skipped.')
+    else:
+        callback(f'🏁 {found} {kind}s kept in the lookup store.')
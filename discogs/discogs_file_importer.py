@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import re
+
+from discogs.db_discogs import get_all_discogs_ids, upsert_releases
+from discogs.discogs_importer import (
+    normalize_artist, normalize_title, normalize_format, normalize_country, normalize_barcodes, normalize_catnos,
+    normalize_release_date)
+from shared.db import transaction
+from shared.config import AppConfig
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+# Releases written per transaction
+FILE_IMPORT_BATCH = 5000
+
+# The collection CSV gives a release's formats as one string, such as
+# '2xLP, Album, RE + 7", Single', starting with a size or a short name where
+# the API has a format name and descriptions
+CSV_FORMAT_NAMES = {
+    'LP': 'Vinyl',
+    '12"': 'Vinyl',
+    '10"': 'Vinyl',
+    '7"': 'Vinyl',
+    'Cass': 'Cassette',
+    'Flexi': 'Flexi-disc',
+    'Box': 'Box Set',
+}
+CSV_VINYL_SIZES = ('LP', '12"', '10"', '7"')
+CSV_FORMAT_DESCRIPTIONS = {
+    'Comp': 'Compilation',
+    'Maxi': 'Maxi-Single',
+    'MiniAlbum': 'Mini-Album',
+    'RE': 'Reissue',
+    'RM': 'Remastered',
+    'RP': 'Repress',
+    'Ltd': 'Limited Edition',
+    'Smplr': 'Sampler',
+}
+CSV_QUANTITY = re.compile(r'^\d+x')
+
+
+def csv_format(value):
+    """Convert the first format of a collection CSV row to the API's name and descriptions"""
+    tokens = [token.strip() for token in value.split(' + ')[0].split(',') if token.strip()]
+    if not tokens:
+        return None
+    primary = CSV_QUANTITY.sub('', tokens[0])
+    descriptions = [CSV_FORMAT_DESCRIPTIONS.get(token, token) for token in tokens[1:]]
+    if primary in CSV_VINYL_SIZES:
+        descriptions.insert(0, primary)
+    return {'name': CSV_FORMAT_NAMES.get(primary, primary), 'descriptions': descriptions}
+
+
+def release_from_csv_row(row):
+    """Return a normalized record from a row of a Discogs collection CSV export
+
+    The export has no barcodes, country or master release, which are left
+    None, and gives the year of release as the release date."""
+    released = (row.get('Released') or '').strip()
+    year = int(released[:4]) if released[:4].isdigit() else 0
+    format0 = csv_format(row.get('Format') or '')
+    catnos = [catno.strip() for catno in (row.get('Catalog#') or '').split(',') if catno.strip()]
+
+    return {
+        "discogs_id": int(row['release_id']),
+        "artist": normalize_artist(row['Artist']),
+        "title": normalize_title(row['Title']),
+        "format": normalize_format(format0) if format0 else None,
+        "catnos": normalize_catnos([{'catno': catno} for catno in catnos]) or None,
+        "year": year or None,
+        "release_date": normalize_release_date(released) if year else None,
+    }
+
+
+def release_from_payload(payload):
+    """Return a normalized record from the JSON of a release, as served by the Discogs API"""
+    return {
+        "discogs_id": int(payload['id']),
+        "artist": normalize_artist(payload['artists'][0]['name']),
+        "title": normalize_title(payload['title']),
+        "format": normalize_format({'descriptions': [], **payload['formats'][0]}),
+        "country": normalize_country(payload.get('country')),
+        "barcodes": normalize_barcodes(payload.get('identifiers') or []) or None,
+        "catnos": normalize_catnos(payload.get('labels') or []) or None,
+        "year": payload.get('year') or None,
+        "master_id": payload.get('master_id') or None,
+        "release_date": normalize_release_date(payload.get('released')),
+    }
+
+
+def read_collection_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def read_release_snapshot(path):
+    """Return the release payloads in a JSON file
+
+    The file holds a list of payloads, or an object with the list under
+    'releases'."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('releases', [])
+    return data
+
+
+def import_from_file(cfg: AppConfig, path, callback=print, should_cancel=lambda: False,
+                     progress_callback=lambda pct: None):
+    """Load releases from a collection CSV export or a JSON snapshot of release payloads
+
+    No requests are made to Discogs. Releases are written in batches with
+    upsert_releases. A CSV only fills in what the database is missing, since
+    it has less detail than the API, while release payloads replace what is
+    stored. The rows have no listing fingerprint, so the next import from
+    Discogs fetches each release once, for the detail and artwork the file
+    lacks."""
+
+    db_path = cfg.db_path
+
+    if os.path.splitext(path)[1].casefold() == '.csv':
+        records = read_collection_csv(path)
+        to_release = release_from_csv_row
+        replace = False
+    else:
+        records = read_release_snapshot(path)
+        to_release = release_from_payload
+        replace = True
+
+    total_records = len(records)
+    if not total_records:
+        callback(f"No releases found in {os.path.basename(path)}.")
+        progress_callback(100)
+        return
+
+    callback(f'Number of items in {os.path.basename(path)}: {total_records}')
+
+    known_ids = set(get_all_discogs_ids(db_path))
+    imported = 0
+    changed = 0
+    skipped = 0
+
+    for start in range(0, total_records, FILE_IMPORT_BATCH):
+        if should_cancel():
+            callback("Import cancelled.")
+            return
+
+        releases = {}
+        for record in records[start:start + FILE_IMPORT_BATCH]:
+            try:
+                release = to_release(record)
+            except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+                skipped += 1
+                logger.debug(f"Skipping unreadable record {record}: {e}")
+                continue
+            releases[release['discogs_id']] = release
+
+        with transaction(db_path):
+            changed += upsert_releases(db_path, releases.values(), replace=replace)
+
+        new_ids = releases.keys() - known_ids
+        imported += len(new_ids)
+        known_ids.update(new_ids)
+
+        progress_callback(int(min(start + FILE_IMPORT_BATCH, total_records) / total_records * 100))
+
+    updated = changed - imported
+    if skipped:
+        callback(f"⚠️ {skipped} records could not be read and were skipped.")
+    callback(f'🏁 {imported} new items imported, {updated} items updated, '
+             f'{total_records - skipped - imported - updated} unchanged items skipped.')
@@ -0,0 +1,232 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from shared.db import context_manager, thread_connection
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+# Authenticated Discogs API requests allowed per rate limit window
+DISCOGS_RATE_LIMIT = 60
+DISCOGS_RATE_PERIOD = 60.0
+
+# Release and master JSON is served from the response cache for this long
+# before it is revalidated. Other responses, such as collection listings,
+# are revalidated every time.
+DISCOGS_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+CACHEABLE_URL = re.compile(r'/(releases|masters)/\d+$')
+
+CREATE_HTTP_CACHE_TABLE = """
+    CREATE TABLE IF NOT EXISTS http_cache (
+        url TEXT PRIMARY KEY,
+        body BLOB NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        fetched_at REAL NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+
+class TokenBucket:
+    """Rate limiter shared by every thread making Discogs API requests
+
+    The bucket refills at limit/period tokens a second, and each request takes
+    one. Discogs counts requests over a moving window, so a burst of the whole
+    budget would leave the next window full; the bucket holds only a few
+    tokens and paces requests evenly instead. Discogs reports the limit and
+    the requests left in the window in the X-Discogs-Ratelimit headers of
+    each response, and update() keeps the bucket from holding more tokens
+    than the server would honour."""
+
+    def __init__(self, limit=DISCOGS_RATE_LIMIT, period=DISCOGS_RATE_PERIOD, burst=1):
+        self.period = period
+        self.limit = limit
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.limit / self.period)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be made"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.period / self.limit
+            time.sleep(wait)
+
+    def update(self, limit=None, remaining=None):
+        """Bring the bucket in line with the rate limit reported by Discogs"""
+        with self._lock:
+            self._refill()
+            if limit:
+                self.limit = limit
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def install_rate_limiter(client, bucket=None, max_attempts=6):
+    """Make every request of a discogs_client.Client take a token from the bucket
+
+    Wraps the fetcher's request method, so every thread sharing the client
+    goes through the same bucket. The library's backoff is replaced by one
+    that also draws from the bucket, and a request still rate limited after
+    max_attempts returns its 429 response. Returns the bucket."""
+
+    bucket = bucket or TokenBucket()
+    client.backoff_enabled = False
+    fetcher = client._fetcher
+    send = fetcher.request
+
+    def request(method, url, *args, **kwargs):
+        for attempt in range(max_attempts):
+            bucket.acquire()
+            response = send(method, url, *args, **kwargs)
+            limit = _header_int(response.headers, 'X-Discogs-Ratelimit')
+            remaining = _header_int(response.headers, 'X-Discogs-Ratelimit-Remaining')
+            if response.status_code != 429:
+                bucket.update(limit, remaining)
+                return response
+
+            logger.debug(f"Rate limited by Discogs on {url} (attempt {attempt + 1}/{max_attempts})")
+            bucket.update(limit, 0)
+            time.sleep(min(2 ** attempt, DISCOGS_RATE_PERIOD))
+        return response
+
+    fetcher.request = request
+    return bucket
+
+
+class ResponseCache:
+    """Disk cache of Discogs API GET responses, keyed by URL
+
+    Kept in a database file of its own next to the app's, so the fetch
+    threads of an import can write to it while the import holds a
+    transaction open on the main database. A response younger than max_age
+    is served without a request if its URL matches CACHEABLE_URL; otherwise
+    the request is made conditional on the stored ETag and Last-Modified,
+    and a 304 is answered from the cache."""
+
+    def __init__(self, cache_path, max_age=DISCOGS_CACHE_MAX_AGE):
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self._revalidate = 0
+        # The journal mode cannot be changed inside a transaction
+        thread_connection(cache_path).execute("PRAGMA journal_mode=WAL;").fetchone()
+        with context_manager(cache_path) as cur:
+            cur.execute(CREATE_HTTP_CACHE_TABLE)
+
+    @contextmanager
+    def revalidating(self):
+        """Revalidate every cached response used inside the block, whatever its age"""
+        self._revalidate += 1
+        try:
+            yield self
+        finally:
+            self._revalidate -= 1
+
+    def get(self, url):
+        with context_manager(self.cache_path) as cur:
+            cur.execute("""
+                SELECT body, etag, last_modified, fetched_at
+                FROM http_cache
+                WHERE url = ?""", (url,))
+            return cur.fetchone()
+
+    def is_fresh(self, url, entry):
+        return (not self._revalidate
+                and CACHEABLE_URL.search(url) is not None
+                and time.time() - entry.fetched_at < self.max_age)
+
+    def put(self, url, body, etag=None, last_modified=None):
+        with context_manager(self.cache_path) as cur:
+            cur.execute("""
+                INSERT INTO http_cache (url, body, etag, last_modified, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    body = excluded.body,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    fetched_at = excluded.fetched_at
+            """, (url, body, etag, last_modified, time.time()))
+
+    def clear(self):
+        with context_manager(self.cache_path) as cur:
+            cur.execute("DELETE FROM http_cache;")
+
+
+def _cached_response(url, body):
+    response = Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.headers = CaseInsensitiveDict()
+    return response
+
+
+def install_response_cache(client, db_path, max_age=DISCOGS_CACHE_MAX_AGE):
+    """Serve a discogs_client.Client's GET requests through a ResponseCache
+
+    The cache lives in discogs_cache.db beside the database at db_path, and
+    is shared by every client installed on it. Install after the rate
+    limiter, so that responses served from the cache take no token. The
+    cache is kept on the client as response_cache, and returned."""
+
+    cache = ResponseCache(os.path.join(os.path.dirname(db_path), 'discogs_cache.db'), max_age)
+    client.response_cache = cache
+    fetcher = client._fetcher
+    send = fetcher.request
+
+    def request(method, url, data=None, headers=None, *args, **kwargs):
+        if method != 'GET':
+            return send(method, url, data, headers, *args, **kwargs)
+
+        entry = cache.get(url)
+        if entry is not None:
+            if cache.is_fresh(url, entry):
+                return _cached_response(url, entry.body)
+            headers = dict(headers or {})
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = send(method, url, data, headers, *args, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            cache.put(url, entry.body, response.headers.get('ETag') or entry.etag,
+                      response.headers.get('Last-Modified') or entry.last_modified)
+            return _cached_response(url, entry.body)
+        if response.status_code == 200:
+            cache.put(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response
+
+    fetcher.request = request
+    return cache
+
+
+def revalidating(client):
+    """Revalidate the client's cached responses inside the block, if it has a cache"""
+    cache = getattr(client, 'response_cache', None)
+    return cache.revalidating() if cache is not None else nullcontext()
@@ -1,30 +1,47 @@
 #!/usr/bin/env python3
 
 import os
+import hashlib
 import random
 import requests
 import time
 # Discogs API logic
 import discogs_client
 from discogs_client.exceptions import HTTPError
+from discogs_client.models import CollectionItemInstance
+from discogs_client.utils import update_qs
 
+import itertools
 import json
 import sys
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 
 from discogs.db_discogs import (
-    get_oauth_tokens, set_oauth_tokens, fetch_row, set_artist, set_title, set_format,
-    set_country, set_barcodes, set_catnos, set_year, set_master_id, set_release_date,
-    set_sort_name, insert_row, set_primary_image_uri, get_all_discogs_ids, fetch_all_rows, delete_discogs_release_row
+    get_oauth_tokens, set_oauth_tokens, set_release_date, upsert_release, set_primary_image_uri,
+    get_all_discogs_ids, fetch_all_rows, delete_discogs_release_row, get_discogs_fingerprints,
+    set_discogs_fingerprint, set_image_status, get_image_status_ids, IMAGE_PENDING, IMAGE_SAVED, IMAGE_FAILED,
+    IMAGE_UNREADABLE, get_unfinished_import_run, start_import_run, get_import_run_releases, add_import_run_release,
+    set_import_run_position, finish_import_run
 )
-from shared.utils import trim_if_ends_with_number_in_brackets, sanitise_identifier, normalize_country_name, earliest_date
+from shared.db import transaction, close_thread_connections
+from shared import images
+from shared.utils import trim_if_ends_with_number_in_brackets, sanitise_identifier, normalize_country_name
 from discogs.discogs_oauth_gui import prompt_oauth_verifier_gui
+from discogs.discogs_http import install_rate_limiter, install_response_cache, revalidating
+from discogs.discogs_artwork import ArtworkDownloader
 from shared.config import DISCOGS_CONSUMER_KEY, DISCOGS_CONSUMER_SECRET, GROOVEKRAFT_USER_AGENT
 import logging
 from shared.config import AppConfig
 
 logger = logging.getLogger(__name__)
 
+# Releases fetched in parallel during an import, and how far the fetches may
+# run ahead of the rows written to the database
+FETCH_WORKERS = 4
+FETCH_AHEAD = FETCH_WORKERS * 4
+
 
 def connect_to_discogs(db_path):
 
@@ -82,6 +99,12 @@ def connect_to_discogs(db_path):
         except Exception as e:
             raise Exception(f"Unable to authenticate to Discogs: {e}")
 
+    # set_consumer_key replaces the fetcher, so the limiter and the cache go
+    # on the one the client ends up with. The cache goes on last, so that
+    # responses served from it take no token from the limiter.
+    install_rate_limiter(client)
+    install_response_cache(client, db_path)
+
     return client, access_token, access_secret
 
 
@@ -113,10 +136,18 @@ def normalize_barcodes(identifiers):
 
 
 def normalize_catnos(labels):
-    catnos_set = set([x.data['catno'] for x in labels])
+    # Label objects from the client, or the label dicts of a release payload
+    catnos_set = set([getattr(x, 'data', x)['catno'] for x in labels])
     return ', '.join(sorted(catnos_set))
 
 
+def normalize_release_date(released):
+    release_date = released or None
+    if isinstance(release_date, str) and release_date.endswith('-00'):
+        release_date = release_date[:len(release_date) - 3]
+    return release_date
+
+
 def discogs_summarise_release(release=None, id=None, discogs_client=None):
     if not release and id and discogs_client:
         release = discogs_client.release(id)
@@ -151,18 +182,91 @@ def discogs_summarise_release(release=None, id=None, discogs_client=None):
     return ' '.join(output)
 
 
+def collection_pages(discogs_client, url, per_page):
+    """Yield each page of a collection listing as (page, items, pagination)
+
+    Pages are fetched one at a time as they are asked for. Unlike the
+    client's PaginatedList, which keeps every page it has loaded, nothing is
+    held once the caller has moved on to the next page."""
+    page = 1
+    while True:
+        data = discogs_client._get(update_qs(url, {'page': page, 'per_page': per_page}))
+        pagination = data['pagination']
+        yield page, [CollectionItemInstance(discogs_client, item) for item in data['releases']], pagination
+        if page >= pagination['pages']:
+            return
+        page += 1
+
+
+def collection_item_fingerprint(item):
+    """Return a digest of a collection listing entry
+
+    The entry carries the instance, when it was added and the release's basic
+    information, which changes when the release is edited on Discogs."""
+    summary = {key: item.data.get(key) for key in ('instance_id', 'date_added', 'basic_information')}
+    return hashlib.sha1(json.dumps(summary, sort_keys=True).encode()).hexdigest()
+
+
+def _identifiers(value):
+    return value.split(', ') if value else ()
+
+
 def likely_match(orphan, candidate):
     # Simple heuristic: match if catnos or barcodes overlap, or artist/title/year match strongly
-    if orphan.catnos and candidate.catnos and set(orphan.catnos.split(', ')) & set(candidate.catnos.split(', ')):
+    if set(_identifiers(orphan.catnos)) & set(_identifiers(candidate.catnos)):
         return True
-    if orphan.barcodes and candidate.barcodes and set(orphan.barcodes.split(', ')) & set(candidate.barcodes.split(', ')):
+    if set(_identifiers(orphan.barcodes)) & set(_identifiers(candidate.barcodes)):
         return True
     if orphan.artist == candidate.artist and orphan.title == candidate.title and orphan.year == candidate.year:
         return True
     return False
 
 
-def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_cancel=lambda: False, progress_callback=lambda pct: None):
+class ReplacementIndex:
+    """Finds the releases likely to replace an orphan, by the rules of likely_match
+
+    The candidates are indexed once by each catalog number, each barcode and
+    (artist, title, year), so an orphan's replacements are found with a few
+    lookups rather than by comparing it with every candidate."""
+
+    def __init__(self, candidates):
+        self._by_catno = defaultdict(list)
+        self._by_barcode = defaultdict(list)
+        self._by_release = defaultdict(list)
+        for candidate in candidates:
+            for catno in set(_identifiers(candidate.catnos)):
+                self._by_catno[catno].append(candidate)
+            for barcode in set(_identifiers(candidate.barcodes)):
+                self._by_barcode[barcode].append(candidate)
+            self._by_release[(candidate.artist, candidate.title, candidate.year)].append(candidate)
+
+    def replacements(self, orphan):
+        """Return the candidates likely to replace the orphan, each once"""
+        found = {}
+        for catno in _identifiers(orphan.catnos):
+            for candidate in self._by_catno.get(catno, ()):
+                found[candidate.discogs_id] = candidate
+        for barcode in _identifiers(orphan.barcodes):
+            for candidate in self._by_barcode.get(barcode, ()):
+                found[candidate.discogs_id] = candidate
+        for candidate in self._by_release.get((orphan.artist, orphan.title, orphan.year), ()):
+            found[candidate.discogs_id] = candidate
+        return list(found.values())
+
+
+def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_cancel=lambda: False, progress_callback=lambda pct: None,
+                        image_manifest=None, full_refresh=False, resume=False):
+
+    # The listing must be current, and a release is only fetched when it is new
+    # or its listing entry has changed, so cached responses are revalidated
+    # rather than trusted until they expire
+    with revalidating(discogs_client):
+        _import_from_discogs(discogs_client, cfg, callback, should_cancel, progress_callback,
+                             image_manifest, full_refresh, resume)
+
+
+def _import_from_discogs(discogs_client, cfg, callback, should_cancel, progress_callback, image_manifest, full_refresh,
+                         resume):
 
     # Only enable debugpy breakpoints in dev, never in a frozen (PyInstaller) app
     if __debug__ and not getattr(sys, 'frozen', False):
@@ -177,21 +281,47 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
     images_folder = cfg.images_folder
 
     os.makedirs(images_folder, exist_ok=True)
+    # Kept up to date as artwork is written, so the caller can share it
+    if image_manifest is None:
+        image_manifest = images.ImageManifest(images_folder)
+    # Done here rather than when the GUI builds the manifest, so that moving a
+    # large folder does not hold up startup, and before any artwork is written
+    moved = image_manifest.shard_flat_images()
+    if moved:
+        callback(f"Moved {moved} images into the sharded images folder.")
     discogs_user = discogs_client.identity()
-    releases = discogs_user.collection_folders[0].releases
-    release_cache = {}
-
-    if not releases:
+    listing_url = discogs_user.collection_folders[0].releases.url
+    # Use the largest page size the API allows to minimise paginated requests
+    page_size = getattr(discogs_client, 'per_page', None) or 100
+
+    # A resumed run reads the listing from the start, as releases may have
+    # moved between pages, but skips the releases it imported with their
+    # artwork before it stopped. Those whose fetch or artwork failed are
+    # imported again. The total comes from the pagination data of the first page.
+    run = get_unfinished_import_run(db_path) if resume else None
+    pages = collection_pages(discogs_client, listing_url, page_size)
+    first_page = next(pages)
+    total_releases = first_page[2]['items']
+
+    if not total_releases:
         callback("No releases found in the Discogs collection.")
         progress_callback(100)
         return
 
-    callback(f'Number of items in all collections: {len(releases)}')
+    callback(f'Number of items in all collections: {total_releases}')
 
     imported = 0
     updated = 0
+    unchanged = 0
     failed = 0
-    total_releases = len(releases)
+
+    if run:
+        run_id = run.run_id
+        processed_ids = get_import_run_releases(db_path, run_id)
+        callback(f"Resuming the import that stopped at item {run.position} of {run.total}.")
+    else:
+        run_id = start_import_run(db_path, total_releases)
+        processed_ids = set()
 
     imported_ids = set()
     failed_ids = set()
@@ -206,9 +336,7 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
         last_error = None
         for attempt in range(1, max_attempts + 1):
             try:
-                release = release_cache.get(release_id)
-                if release is None or attempt > 1:
-                    release = discogs_client.release(release_id)
+                release = discogs_client.release(release_id)
 
                 # Force a fetch so we surface HTTP errors early
                 _ = release.title
@@ -218,9 +346,7 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
                 _ = release.year
                 _ = release.country
 
-                release_date = release.fetch('released') or None
-                if isinstance(release_date, str) and release_date.endswith('-00'):
-                    release_date = release_date[:len(release_date) - 3]
+                release_date = normalize_release_date(release.fetch('released'))
 
                 artist = normalize_artist(release.artists[0].name)
                 title = normalize_title(release.title)
@@ -246,7 +372,6 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
                     if not primary_image_url:
                         primary_image_url = release.images[0]['uri']
 
-                release_cache[release_id] = release
                 return {
                     "release": release,
                     "release_date": release_date,
@@ -263,7 +388,6 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
 
             except (HTTPError, json.decoder.JSONDecodeError, requests.RequestException) as e:
                 last_error = e
-                release_cache.pop(release_id, None)
                 status_code = _status_code_from_http_error(e) if isinstance(e, HTTPError) else None
                 is_404 = status_code == 404 or "404" in str(e)
                 if attempt < max_attempts:
@@ -280,7 +404,6 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
                 return None
             except Exception as e:
                 last_error = e
-                release_cache.pop(release_id, None)
                 callback(f"❌ Error fetching release {release_id}: {e}")
                 return None
 
@@ -288,98 +411,177 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
             callback(f"❌ Error fetching release {release_id}: {last_error}")
         return None
 
-    for index, release_summary in enumerate(releases, start=1):
-        if should_cancel():
-            callback("Import cancelled.")
-            return
+    def _fetch_in_worker(release_id):
+        # Runs on the fetch pool, whose threads open a connection to the
+        # response cache; nothing would close it when the pool shuts down
+        try:
+            return _fetch_release_data(release_id)
+        finally:
+            close_thread_connections()
 
-        percent = int((index / total_releases) * 100)
-        progress_callback(percent)
+    def _import_release(index, release_summary, fingerprint, data):
+        nonlocal imported, updated, failed
 
-        data = _fetch_release_data(release_summary.id)
         if not data:
             failed += 1
             failed_ids.add(release_summary.id)
-            continue
+            return
 
         release = data["release"]
-        release_date = data["release_date"]
 
         callback(f'⚙️ {index}/{total_releases} {discogs_summarise_release(release=release)}')
 
-        artist = data["artist"]
-        title = data["title"]
-        format = data["format"]
-        country = data["country"]
-        barcodes = data["barcodes"]
-        catnos = data["catnos"]
-        year = data["year"]
-        master_id = data["master_id"]
-
-        row = fetch_row(db_path, release.id)
-        release_date = earliest_date(row.release_date if row else None, release_date)
+        row = upsert_release(db_path, release.id, {
+            "artist": data["artist"],
+            "title": data["title"],
+            "format": data["format"],
+            "country": data["country"],
+            "barcodes": data["barcodes"] or None,
+            "catnos": data["catnos"] or None,
+            "year": data["year"],
+            "master_id": data["master_id"],
+            "release_date": data["release_date"],
+        }, callback=callback)
 
         if row:
-
-            set_artist(db_path, release.id, artist, callback=callback)
-            set_title(db_path, release.id, title, callback=callback)
-            set_format(db_path, release.id, format, callback=callback)
-            set_country(db_path, release.id, country, callback=callback)
-            set_barcodes(db_path, release.id, barcodes or None, callback=callback)
-            set_catnos(db_path, release.id, catnos or None, callback=callback)
-            set_year(db_path, release.id, year, callback=callback)
-            set_master_id(db_path, release.id, master_id, callback=callback)
-            # Only update the release date if the release_date_locked flag is not set
-            if getattr(row, "release_date_locked", None) in (None, 0):
-                set_release_date(db_path, release.id, release_date, callback=callback)
-
-            if not row.sort_name:
-                set_sort_name(db_path, release.id, artist, callback=callback)
-
             updated += 1
         else:
-            insert_row(
-                db_path,
-                discogs_id=release.id,
-                artist=artist,
-                title=title,
-                format=format,
-                country=country,
-                year=year,
-                barcodes=barcodes or None,
-                catnos=catnos or None,
-                master_id=master_id,
-                sort_name=artist,
-                release_date=release_date
-            )
             imported += 1
 
         imported_ids.add(release.id)
+        add_import_run_release(db_path, run_id, release.id)
 
         primary_image_url = data["primary_image_url"]
 
         existing_uri = getattr(row, 'primary_image_uri', None) if row else None
 
         if primary_image_url and primary_image_url != existing_uri:
-            headers = {"User-Agent": discogs_client.user_agent}
-            image_path = os.path.join(images_folder, f"{release.id}.jpg")
-
-            for attempt in range(2):  # Try up to 2 times
-                try:
-                    response = requests.get(primary_image_url, headers=headers, timeout=10)
-                    response.raise_for_status()
-                    with open(image_path, "wb") as f:
-                        f.write(response.content)
-                    if row:
-                        set_primary_image_uri(
-                            db_path,
-                            release.id,
-                            primary_image_url,
-                            callback=callback)
-                    break  # Success, break out of retry loop
-                except Exception as e:
-                    if attempt == 1:
-                        callback(f"Warning: Failed to download image for release {release.id}: {e}")
+            set_image_status(db_path, release.id, IMAGE_PENDING)
+            artwork.submit(release.id, primary_image_url)
+
+        set_discogs_fingerprint(db_path, release.id, fingerprint)
+
+    def _record_artwork(results):
+        for discogs_id, url, error in results:
+            if error:
+                callback(f"Warning: Failed to download image for release {discogs_id}: {error}")
+                set_image_status(db_path, discogs_id, IMAGE_FAILED)
+                continue
+
+            image_manifest.add_image(discogs_id)
+            # Record the URI for new releases too, so the artwork and
+            # its thumbnails are only fetched again when it changes
+            set_primary_image_uri(
+                db_path,
+                discogs_id,
+                url,
+                callback=callback)
+            set_image_status(db_path, discogs_id, IMAGE_SAVED)
+            thumbnail_generator.submit(discogs_id)
+
+    # Releases are numbered by their position in the whole listing
+    def _numbered_releases():
+        for page, items, _ in itertools.chain([first_page], pages):
+            for offset, item in enumerate(items, start=1):
+                yield (page - 1) * page_size + offset, item
+
+    numbered_releases = _numbered_releases()
+
+    # Only releases whose listing entry has changed since the last import are
+    # fetched, unless a full refresh is asked for
+    fingerprints = {} if full_refresh else get_discogs_fingerprints(db_path)
+    if fingerprints:
+        callback("Fetching only the releases that have changed since the last import.")
+
+    # Releases are fetched on a pool of threads, which share the client's rate
+    # limiter, while this thread writes them to the database in collection order.
+    # Artwork is downloaded on a pool of its own, and recorded here as it arrives.
+    fetches = deque()
+
+    def _fetch_ahead(executor):
+        while len(fetches) < FETCH_AHEAD:
+            item = next(numbered_releases, None)
+            if item is None:
+                return
+            index, release_summary = item
+            fingerprint = collection_item_fingerprint(release_summary)
+            if release_summary.id in processed_ids or fingerprints.get(release_summary.id) == fingerprint:
+                future = None
+            else:
+                future = executor.submit(_fetch_in_worker, release_summary.id)
+            fetches.append((index, release_summary, fingerprint, future))
+
+    def _write_batch(batch):
+        nonlocal unchanged
+        # Commit once per batch rather than once per field
+        with transaction(db_path):
+            for index, release_summary, fingerprint, future in batch:
+                percent = int((index / total_releases) * 100)
+                progress_callback(percent)
+
+                if future is None:
+                    imported_ids.add(release_summary.id)
+                    if release_summary.id not in processed_ids:
+                        unchanged += 1
+                        add_import_run_release(db_path, run_id, release_summary.id)
+                else:
+                    _import_release(index, release_summary, fingerprint, future.result())
+
+            _record_artwork(artwork.completed())
+            # Checkpoint in the same transaction as the releases
+            set_import_run_position(db_path, run_id, (index - 1) // page_size + 1, index)
+
+    executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='discogs-fetch')
+    try:
+        # Thumbnails are generated in worker processes while the import goes on
+        with images.ThumbnailGenerator(images_folder, callback=callback, manifest=image_manifest) as thumbnail_generator, \
+                ArtworkDownloader(images_folder, discogs_client.user_agent) as artwork:
+            _fetch_ahead(executor)
+            while fetches:
+                # Fetches are waited for outside the transaction, so the
+                # database is only locked while a batch of releases that are
+                # ready is written: up to a page of them, or those fetched so
+                # far when the next one is still on its way
+                batch = []
+                while fetches and len(batch) < page_size:
+                    if should_cancel():
+                        if batch:
+                            _write_batch(batch)
+                        thumbnail_generator.cancel()
+                        callback("Import cancelled.")
+                        return
+
+                    future = fetches[0][3]
+                    if future is not None and not future.done():
+                        if batch:
+                            break
+                        wait((future,))
+
+                    batch.append(fetches.popleft())
+                    _fetch_ahead(executor)
+
+                _write_batch(batch)
+
+            with transaction(db_path):
+                _record_artwork(artwork.wait())
+
+            # Artwork downloaded before thumbnails existed, other than artwork
+            # that could not be decoded by an earlier import
+            unreadable = get_image_status_ids(db_path, IMAGE_UNREADABLE)
+            missing_thumbnails = [discogs_id for discogs_id in image_manifest.missing_thumbnails()
+                                  if discogs_id not in unreadable]
+            if missing_thumbnails:
+                callback(f"Generating thumbnails for {len(missing_thumbnails)} releases.")
+                for discogs_id in missing_thumbnails:
+                    thumbnail_generator.submit(discogs_id)
+
+        # Kept until the release's artwork changes, when it is downloaded again
+        with transaction(db_path):
+            for discogs_id in thumbnail_generator.unreadable:
+                set_image_status(db_path, discogs_id, IMAGE_UNREADABLE)
+    finally:
+        # Drop the fetches queued ahead of an import that was cancelled or failed
+        executor.shutdown(cancel_futures=True)
 
     # Identify orphans and possible replacements
     all_db_ids = get_all_discogs_ids(db_path)
@@ -392,18 +594,14 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
         callback(f"Found {len(orphans)} orphaned releases in database not in latest import.")
         all_rows = fetch_all_rows(db_path)
         id_to_row = {row.discogs_id: row for row in all_rows}
+        replacement_index = ReplacementIndex(
+            id_to_row[candidate_id] for candidate_id in imported_ids if candidate_id in id_to_row)
 
         for orphan_id in orphans:
             orphan = id_to_row.get(orphan_id)
             if not orphan:
                 continue
-            replacements = []
-            for candidate_id in imported_ids:
-                candidate = id_to_row.get(candidate_id)
-                if not candidate:
-                    continue
-                if likely_match(orphan, candidate):
-                    replacements.append(candidate)
+            replacements = replacement_index.replacements(orphan)
 
             if replacements:
                 locked_date_copied = False
@@ -424,4 +622,6 @@ def import_from_discogs(discogs_client, cfg: AppConfig, callback=print, should_c
             else:
                 callback(f"No replacements found for orphan release {orphan_id}.")
 
-    callback(f'🏁 {imported} new items imported, {updated} items updated, {failed} releases failed.')
+    finish_import_run(db_path, run_id)
+
+    callback(f'🏁 {imported} new items imported, {updated} items updated, {unchanged} unchanged items skipped, {failed} releases failed.')
@@ -5,6 +5,7 @@
 import sys
 import argparse
 import signal
+import multiprocessing
 from dateutil import parser
 import logging
 import configparser
@@ -38,6 +39,10 @@ def get_user_data_dir(app_name: str) -> Path:
 
 if __name__ == "__main__":
 
+    # Thumbnail generation runs in worker processes, which a frozen app
+    # must be able to start from its own executable
+    multiprocessing.freeze_support()
+
     signal.signal(signal.SIGINT, signal_handler)
 
     parser = argparse.ArgumentParser(
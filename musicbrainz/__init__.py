@@ -1,4 +1,5 @@
 from . import mb_auth_gui
+from . import mb_cache
 from . import mb_matcher
 from . import db_musicbrainz
 
@@ -90,11 +90,11 @@ def insert_row(
 
 def fetch_row(db_path, discogs_id):
     with context_manager(db_path) as cur:
-        cur.execute(f"""
+        cur.execute("""
             SELECT id, discogs_id, mbid, artist, title, country, score, matched_at
             FROM mb_matches
-            WHERE discogs_id = {discogs_id}
-            """)
+            WHERE discogs_id = ?
+            """, (discogs_id,))
         item = cur.fetchone()
         return item
 
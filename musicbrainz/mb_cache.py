@@ -0,0 +1,186 @@
+import json
+import os
+import time
+import urllib.error
+
+import musicbrainzngs
+
+from shared.db import context_manager, thread_connection
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+DAY = 24 * 60 * 60
+
+# How long the responses of each musicbrainzngs function are kept. Lookups by
+# MBID rarely change; browses and searches pick up new releases and links, so
+# they are kept for less. Functions not listed are never cached.
+MB_CACHE_TTLS = {
+    'get_release_by_id': 30 * DAY,
+    'get_release_group_by_id': 30 * DAY,
+    'browse_releases': 7 * DAY,
+    'browse_urls': 7 * DAY,
+    'search_releases': 7 * DAY,
+    'search_release_groups': 7 * DAY,
+    'search_artists': 7 * DAY,
+}
+
+# Total size of the cached responses before the least recently used are
+# evicted, and the fraction of it they are evicted down to
+MB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+MB_CACHE_EVICT_TO = 0.9
+
+CREATE_MB_CACHE_TABLE = """
+    CREATE TABLE IF NOT EXISTS mb_cache (
+        key TEXT PRIMARY KEY,
+        body TEXT,
+        size INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+CREATE_IDX_MB_CACHE_ACCESSED_AT = "CREATE INDEX IF NOT EXISTS idx_mb_cache_accessed_at ON mb_cache (accessed_at);"
+
+# The cache installed by install_cache(), used by call()
+_cache = None
+
+
+def _is_not_found(exc):
+    return isinstance(exc, musicbrainzngs.ResponseError) and getattr(exc.cause, 'code', None) == 404
+
+
+def _not_found_error(key):
+    return musicbrainzngs.ResponseError(
+        "cached", cause=urllib.error.HTTPError(key, 404, "Not Found", None, None))
+
+
+class MBResponseCache:
+    """Disk cache of MusicBrainz web service responses
+
+    Responses are keyed on the musicbrainzngs function and its arguments,
+    with includes sorted, and kept as JSON for the function's TTL. A 404 is
+    cached too, as most Discogs links are not in MusicBrainz, and raised
+    again as a ResponseError. Once the responses take more than max_bytes,
+    the least recently used are evicted. Kept in a database file of its own
+    next to the app's."""
+
+    def __init__(self, cache_path, max_bytes=MB_CACHE_MAX_BYTES, ttls=MB_CACHE_TTLS):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        # The journal mode cannot be changed inside a transaction
+        thread_connection(cache_path).execute("PRAGMA journal_mode=WAL;").fetchone()
+        with context_manager(cache_path) as cur:
+            cur.execute(CREATE_MB_CACHE_TABLE)
+            cur.execute(CREATE_IDX_MB_CACHE_ACCESSED_AT)
+        self._bytes = self.size()
+
+    @staticmethod
+    def key(name, args, kwargs):
+        kwargs = dict(kwargs)
+        if kwargs.get('includes'):
+            kwargs['includes'] = sorted(kwargs['includes'])
+        return json.dumps([name, args, kwargs], sort_keys=True)
+
+    def size(self):
+        with context_manager(self.cache_path, namedtuple=False) as cur:
+            cur.execute("SELECT COALESCE(SUM(size), 0) FROM mb_cache")
+            return cur.fetchone()[0]
+
+    def get(self, key):
+        """Return the cached entry for key if it has not expired, or None"""
+        now = time.time()
+        with context_manager(self.cache_path) as cur:
+            cur.execute("SELECT body, expires_at FROM mb_cache WHERE key = ?", (key,))
+            entry = cur.fetchone()
+            if entry is None or entry.expires_at < now:
+                return None
+            cur.execute("UPDATE mb_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return entry
+
+    def put(self, key, body, ttl):
+        now = time.time()
+        size = len(key) + len(body or '')
+        with context_manager(self.cache_path) as cur:
+            cur.execute("""
+                INSERT INTO mb_cache (key, body, size, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    body = excluded.body,
+                    size = excluded.size,
+                    expires_at = excluded.expires_at,
+                    accessed_at = excluded.accessed_at
+            """, (key, body, size, now + ttl, now))
+
+        self._bytes += size
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop expired responses, then the least recently used down to MB_CACHE_EVICT_TO of max_bytes"""
+        with context_manager(self.cache_path, namedtuple=False) as cur:
+            cur.execute("DELETE FROM mb_cache WHERE expires_at < ?", (time.time(),))
+            cur.execute("SELECT COALESCE(SUM(size), 0) FROM mb_cache")
+            total = cur.fetchone()[0]
+
+            target = self.max_bytes * MB_CACHE_EVICT_TO
+            evicted = []
+            if total > target:
+                cur.execute("SELECT key, size FROM mb_cache ORDER BY accessed_at")
+                for key, size in cur:
+                    evicted.append((key,))
+                    total -= size
+                    if total <= target:
+                        break
+                cur.executemany("DELETE FROM mb_cache WHERE key = ?", evicted)
+
+        logger.debug(f"Evicted {len(evicted)} MusicBrainz responses from the cache")
+        self._bytes = total
+
+    def clear(self):
+        with context_manager(self.cache_path) as cur:
+            cur.execute("DELETE FROM mb_cache;")
+        self._bytes = 0
+
+    def call(self, func, *args, **kwargs):
+        """Return func(*args, **kwargs), from the cache if it holds the response"""
+        name = getattr(func, "__name__", None)
+        ttl = self.ttls.get(name)
+        if not ttl:
+            return func(*args, **kwargs)
+
+        key = self.key(name, args, kwargs)
+        entry = self.get(key)
+        if entry is not None:
+            if entry.body is None:
+                raise _not_found_error(key)
+            return json.loads(entry.body)
+
+        try:
+            result = func(*args, **kwargs)
+        except musicbrainzngs.ResponseError as exc:
+            if _is_not_found(exc):
+                self.put(key, None, ttl)
+            raise
+
+        self.put(key, json.dumps(result), ttl)
+        return result
+
+
+def install_cache(db_path):
+    """Cache the MusicBrainz responses of every call() in musicbrainz_cache.db beside the database"""
+    global _cache
+    cache_path = os.path.join(os.path.dirname(db_path), 'musicbrainz_cache.db')
+    if _cache is None or _cache.cache_path != cache_path:
+        _cache = MBResponseCache(cache_path)
+    return _cache
+
+
+def call(func, *args, **kwargs):
+    """Call a musicbrainzngs function through the installed cache, if there is one"""
+    if _cache is None:
+        return func(*args, **kwargs)
+    return _cache.call(func, *args, **kwargs)
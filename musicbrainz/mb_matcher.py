@@ -7,10 +7,11 @@ import logging
 import socket
 import time
 import urllib.error
+from collections import OrderedDict
 from http.client import RemoteDisconnected
 
 from discogs import db_discogs
-from musicbrainz import db_musicbrainz
+from musicbrainz import db_musicbrainz, mb_cache
 from shared.db import context_manager, db_summarise_row
 from shared import utils
 import musicbrainzngs
@@ -45,6 +46,14 @@ DEFAULT_MB_INITIAL_DELAY = 0.5
 DEFAULT_MB_BACKOFF_FACTOR = 2.0
 DEFAULT_MB_MAX_SLEEP = 8.0
 
+# Includes requested whenever a release or release group is looked up: the
+# union of those the matcher asks for, so that each MBID is fetched once a run
+MB_ENTITY_INCLUDES = {
+    'get_release_by_id': ('artists', 'artist-credits', 'labels', 'media', 'release-groups', 'url-rels'),
+    'get_release_group_by_id': ('artists', 'artist-credits', 'releases', 'media'),
+}
+MB_ENTITY_STORE_SIZE = 256
+
 MB_NETWORK_ERROR = getattr(musicbrainzngs.musicbrainz, "NetworkError", None)
 MB_RESPONSE_ERROR = getattr(musicbrainzngs.musicbrainz, "ResponseError", None)
 
@@ -94,7 +103,8 @@ def musicbrainz_request(func, *args, _callback=None, _max_retries=DEFAULT_MB_MAX
 
     for attempt in range(1, _max_retries + 1):
         try:
-            return func(*args, **kwargs)
+            # Served from the response cache when it holds the response
+            return mb_cache.call(func, *args, **kwargs)
         except Exception as exc:
             transient = _is_transient_musicbrainz_error(exc)
             should_retry = transient and attempt < _max_retries
@@ -140,7 +150,50 @@ def musicbrainz_request(func, *args, _callback=None, _max_retries=DEFAULT_MB_MAX
             time.sleep(wait_time)
 
 
+class MBEntityStore:
+    """Releases and release groups looked up during a match run, by MBID
+
+    Remembers the includes each entity was loaded with. A lookup whose
+    includes have all been loaded is answered from the store. Otherwise the
+    entity is fetched with the union of the includes loaded so far, those
+    asked for and the defaults in MB_ENTITY_INCLUDES, so that lookups with
+    other includes later need no request. The least recently used entities
+    are dropped beyond max_entities."""
+
+    def __init__(self, max_entities=MB_ENTITY_STORE_SIZE):
+        self.max_entities = max_entities
+        self._entities = OrderedDict()
+
+    def clear(self):
+        self._entities.clear()
+
+    def lookup(self, operation, mbid, includes, fetch):
+        """Return the response for mbid, calling fetch(includes) if it needs loading"""
+        key = (operation, mbid)
+        loaded, response = self._entities.get(key, (frozenset(), None))
+        if response is not None and loaded.issuperset(includes):
+            self._entities.move_to_end(key)
+            return response
+
+        includes = loaded.union(includes, MB_ENTITY_INCLUDES[operation])
+        response = fetch(sorted(includes))
+        if response:
+            self._entities[key] = (includes, response)
+            self._entities.move_to_end(key)
+            while len(self._entities) > self.max_entities:
+                self._entities.popitem(last=False)
+        return response
+
+
+_entity_store = MBEntityStore()
+
+
 def _mb_call(func, *args, _callback=None, **kwargs):
+    operation = getattr(func, "__name__", None)
+    if operation in MB_ENTITY_INCLUDES and len(args) == 1 and set(kwargs) <= {'includes'}:
+        return _entity_store.lookup(
+            operation, args[0], kwargs.get('includes') or (),
+            lambda includes: musicbrainz_request(func, *args, _callback=_callback, includes=includes))
     return musicbrainz_request(func, *args, _callback=_callback, **kwargs)
 
 
@@ -1289,6 +1342,11 @@ def match_discogs_against_mb(db_path, callback=print, should_cancel=lambda: Fals
         progress_callback(100)
         return
 
+    # A repeated match run is answered from the cache rather than the network
+    mb_cache.install_cache(db_path)
+    # Releases may have changed since the last run
+    _entity_store.clear()
+
     matches_attempted = 0
     matches_succeeded = 0
     total_rows = len(rows)
@@ -2,6 +2,7 @@
 
 from . import config
 from . import db
+from . import collection
 from . import utils
 
 import logging
@@ -0,0 +1,135 @@
+import random
+from collections import OrderedDict
+
+from shared.db import context_manager, fts_match_query, fts_filter_sql
+
+
+def release_filters(artist='', title='', storage_format=None, year_from='', year_to='', alias='d'):
+    """Build the WHERE conditions for the collection filters
+
+    Returns a list of conditions on the aliased discogs_releases table, to be
+    joined with AND, and the list of parameters they bind, in order. Empty
+    filters add nothing, and year bounds that are not numbers are ignored."""
+
+    where_clauses = []
+    params = []
+
+    artist_query = fts_match_query(artist, ['artist', 'sort_name'])
+    if artist_query:
+        where_clauses.append(fts_filter_sql(alias))
+        params.append(artist_query)
+    title_query = fts_match_query(title, ['title'])
+    if title_query:
+        where_clauses.append(fts_filter_sql(alias))
+        params.append(title_query)
+    if storage_format:
+        where_clauses.append(f'{alias}.storage_format = ?')
+        params.append(storage_format)
+    if year_from and year_from.strip().isdigit():
+        where_clauses.append(f'{alias}.release_year >= ?')
+        params.append(int(year_from))
+    if year_to and year_to.strip().isdigit():
+        where_clauses.append(f'{alias}.release_year <= ?')
+        params.append(int(year_to))
+
+    return where_clauses, params
+
+
+# Everything the collection views show for a release, with its match, so a
+# list is built from one query rather than a lookup per row
+RELEASE_COLUMNS = """
+    d.sort_name, d.artist, d.title, d.format, d.country, d.release_date, d.release_date_locked,
+    d.discogs_id, d.storage_format, m.mbid, COALESCE(m.score, 0) AS score
+"""
+
+RELEASE_DETAIL_COLUMNS = """
+    d.catnos, d.barcodes, d.play_count, d.last_played
+"""
+
+DEFAULT_ORDER = 'd.sort_name, d.release_date, d.title, d.discogs_id'
+
+
+def fetch_releases(db_path, where_clauses=(), params=(), order_by=DEFAULT_ORDER):
+    """Return the releases matching the conditions, with their match score and mbid"""
+    with context_manager(db_path) as cur:
+        query = []
+        query.append(f'SELECT {RELEASE_COLUMNS}')
+        query.append('FROM discogs_releases d')
+        query.append('LEFT JOIN mb_matches m USING(discogs_id)')
+        if where_clauses:
+            query.append('WHERE ' + ' AND '.join(where_clauses))
+        query.append(f'ORDER BY {order_by}')
+        cur.execute(' '.join(query), params)
+        return cur.fetchall()
+
+
+def fetch_release(db_path, discogs_id):
+    """Return one release as fetch_releases does, plus the fields of the detail view"""
+    with context_manager(db_path) as cur:
+        cur.execute(f"""
+            SELECT {RELEASE_COLUMNS}, {RELEASE_DETAIL_COLUMNS}
+            FROM discogs_releases d
+            LEFT JOIN mb_matches m USING(discogs_id)
+            WHERE d.discogs_id = ?
+        """, (discogs_id,))
+        return cur.fetchone()
+
+
+class RandomReleasePicker:
+    """Picks releases uniformly at random from a filtered collection
+
+    The discogs_ids matching a set of filters are read once and kept in memory,
+    so counting and picking is a list lookup rather than a COUNT(*) and an
+    ORDER BY RANDOM() over the collection. The cached lists are dropped by
+    invalidate(), and whenever another connection has changed the database."""
+
+    def __init__(self, db_path, max_filters=16):
+        self.db_path = db_path
+        self.max_filters = max_filters
+        self._ids = OrderedDict()
+        self._data_version = None
+
+    def invalidate(self):
+        self._ids.clear()
+
+    def _check_data_version(self):
+        # PRAGMA data_version changes when another connection (e.g. the import
+        # worker's) commits, but not for writes made on this thread's connection.
+        with context_manager(self.db_path) as cur:
+            cur.execute("PRAGMA data_version;")
+            data_version = cur.fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.invalidate()
+
+    def matching_ids(self, where_clauses, params):
+        """Return the discogs_ids matching the filters built by release_filters"""
+        self._check_data_version()
+
+        key = (tuple(where_clauses), tuple(params))
+        ids = self._ids.get(key)
+        if ids is not None:
+            self._ids.move_to_end(key)
+            return ids
+
+        with context_manager(self.db_path, namedtuple=False) as cur:
+            query = ['SELECT d.discogs_id FROM discogs_releases d']
+            if where_clauses:
+                query.append('WHERE ' + ' AND '.join(where_clauses))
+            cur.execute(' '.join(query), params)
+            ids = [row[0] for row in cur.fetchall()]
+
+        self._ids[key] = ids
+        if len(self._ids) > self.max_filters:
+            self._ids.popitem(last=False)
+        return ids
+
+    def count(self, where_clauses, params):
+        return len(self.matching_ids(where_clauses, params))
+
+    def pick(self, where_clauses, params):
+        """Return a random matching discogs_id, or None if nothing matches"""
+        ids = self.matching_ids(where_clauses, params)
+        if not ids:
+            return None
+        return random.choice(ids)
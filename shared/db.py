@@ -1,14 +1,14 @@
 import os
+import re
 from contextlib import contextmanager
 import sqlite3
+import threading
 from collections import namedtuple
+from functools import lru_cache
 import logging
-CREATE_IDX_DISCOGS_ID = "CREATE UNIQUE INDEX IF NOT EXISTS idx_discogs_id ON discogs_releases (discogs_id);"
 CREATE_IDX_RELEASE_DATE = "CREATE INDEX IF NOT EXISTS idx_release_date ON discogs_releases (release_date);"
-CREATE_IDX_MATCHES_DISCOGS_ID = "CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_discogs_id ON mb_matches (discogs_id);"
 CREATE_IDX_MATCHES_MBID = "CREATE INDEX IF NOT EXISTS idx_matches_mbid ON mb_matches (mbid);"
 CREATE_IDX_MB_CREDENTIALS_USERNAME = "CREATE UNIQUE INDEX IF NOT EXISTS idx_mb_credentials_username ON mb_credentials (username);"
-CREATE_IDX_MB_MATCHES_MBID = "CREATE INDEX IF NOT EXISTS idx_mb_matches_mbid ON mb_matches (mbid);"
 CREATE_IDX_SORT_NAME = "CREATE INDEX IF NOT EXISTS idx_sort_name ON discogs_releases (sort_name);"
 CREATE_IDX_ARTIST = "CREATE INDEX IF NOT EXISTS idx_artist ON discogs_releases (artist);"
 CREATE_IDX_TITLE = "CREATE INDEX IF NOT EXISTS idx_title ON discogs_releases (title);"
@@ -19,6 +19,10 @@ CREATE_IDX_FORMAT = "CREATE INDEX IF NOT EXISTS idx_format ON discogs_releases (
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
+# Each thread (GUI, import worker, match worker) keeps its own connections,
+# since sqlite3 connections may not be shared between threads.
+_thread_state = threading.local()
+
 CREATE_DISCOGS_RELEASES_TABLE = """
     CREATE TABLE IF NOT EXISTS discogs_releases (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -96,64 +100,282 @@ CREATE_MB_CREDENTIALS_TABLE = """
 """
 
 
+# Full-text index over the searchable text of discogs_releases. It is an
+# external-content table, so it stores only the index, and triggers keep it in
+# step with the releases table.
+CREATE_DISCOGS_RELEASES_FTS_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS discogs_releases_fts USING fts5(
+        artist, sort_name, title, catnos, barcodes,
+        content='discogs_releases',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    );
+"""
+
+CREATE_DISCOGS_RELEASES_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS discogs_releases_fts_insert
+    AFTER INSERT
+        ON discogs_releases
+    BEGIN
+        INSERT INTO discogs_releases_fts (rowid, artist, sort_name, title, catnos, barcodes)
+        VALUES (NEW.id, NEW.artist, NEW.sort_name, NEW.title, NEW.catnos, NEW.barcodes);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS discogs_releases_fts_delete
+    AFTER DELETE
+        ON discogs_releases
+    BEGIN
+        INSERT INTO discogs_releases_fts (discogs_releases_fts, rowid, artist, sort_name, title, catnos, barcodes)
+        VALUES ('delete', OLD.id, OLD.artist, OLD.sort_name, OLD.title, OLD.catnos, OLD.barcodes);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS discogs_releases_fts_update
+    AFTER UPDATE OF artist, sort_name, title, catnos, barcodes
+        ON discogs_releases
+    BEGIN
+        INSERT INTO discogs_releases_fts (discogs_releases_fts, rowid, artist, sort_name, title, catnos, barcodes)
+        VALUES ('delete', OLD.id, OLD.artist, OLD.sort_name, OLD.title, OLD.catnos, OLD.barcodes);
+        INSERT INTO discogs_releases_fts (rowid, artist, sort_name, title, catnos, barcodes)
+        VALUES (NEW.id, NEW.artist, NEW.sort_name, NEW.title, NEW.catnos, NEW.barcodes);
+    END;
+    """,
+]
+
+# Storage format (where the release lives on the shelves) derived from the
+# Discogs format description. It is a generated column so it is computed on
+# write and can be indexed for the format filters.
+ADD_COLUMN_STORAGE_FORMAT = """
+    ALTER TABLE discogs_releases ADD COLUMN storage_format TEXT GENERATED ALWAYS AS (
+        CASE
+            WHEN LOWER(format) LIKE '%cd%' THEN 'Compact Disc'
+            WHEN LOWER(format) LIKE '%box set%' AND LOWER(format) LIKE '%vinyl%' THEN '12" vinyl'
+            WHEN LOWER(format) LIKE '%box set%' THEN 'Compact Disc'
+            WHEN LOWER(format) LIKE '%vinyl%' AND (
+                LOWER(REPLACE(REPLACE(format, '”', '"'), '“', '"')) LIKE '%7"%'
+                OR LOWER(format) LIKE '%7 inch%') THEN '7" vinyl'
+            WHEN LOWER(format) LIKE '%vinyl%' THEN '12" vinyl'
+            ELSE NULL
+        END
+    ) VIRTUAL;
+"""
+
+CREATE_IDX_STORAGE_FORMAT = "CREATE INDEX IF NOT EXISTS idx_storage_format ON discogs_releases (storage_format);"
+
+# Parts of release_date (YYYY, YYYY-MM or YYYY-MM-DD) as integers, so that
+# year ranges and anniversaries can be looked up through an index. A part is
+# NULL when the date does not carry it, and release_day is NULL for dates that
+# are not real calendar days.
+ADD_COLUMNS_RELEASE_DATE_PARTS = [
+    """
+    ALTER TABLE discogs_releases ADD COLUMN release_year INTEGER GENERATED ALWAYS AS (
+        CASE WHEN release_date GLOB '[0-9][0-9][0-9][0-9]*'
+            THEN CAST(substr(release_date, 1, 4) AS INTEGER)
+        END
+    ) VIRTUAL;
+    """,
+    """
+    ALTER TABLE discogs_releases ADD COLUMN release_month INTEGER GENERATED ALWAYS AS (
+        CASE WHEN release_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*'
+                AND CAST(substr(release_date, 6, 2) AS INTEGER) BETWEEN 1 AND 12
+            THEN CAST(substr(release_date, 6, 2) AS INTEGER)
+        END
+    ) VIRTUAL;
+    """,
+    """
+    ALTER TABLE discogs_releases ADD COLUMN release_day INTEGER GENERATED ALWAYS AS (
+        CASE WHEN release_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+                AND date(release_date, '+0 days') = release_date
+            THEN CAST(substr(release_date, 9, 2) AS INTEGER)
+        END
+    ) VIRTUAL;
+    """,
+]
+
+CREATE_IDX_RELEASE_YEAR = "CREATE INDEX IF NOT EXISTS idx_release_year ON discogs_releases (release_year);"
+CREATE_IDX_RELEASE_MONTH_DAY = "CREATE INDEX IF NOT EXISTS idx_release_month_day ON discogs_releases (release_month, release_day);"
+
+# Digest of the collection listing entry a release was last imported from, so
+# that an import can skip releases whose listing has not changed
+ADD_COLUMN_DISCOGS_FINGERPRINT = "ALTER TABLE discogs_releases ADD COLUMN discogs_fingerprint TEXT;"
+
+# updated_at is compared with mb_matches.matched_at to find releases to match
+# again, so it only follows the columns the matcher uses, not bookkeeping such
+# as the fingerprint or play counts
+CREATE_DISCOGS_RELEASES_METADATA_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS update_discogs_releases_updatetime
+    BEFORE UPDATE OF artist, title, year, barcodes, catnos, country, format, master_id, release_date, sort_name
+        ON discogs_releases
+    BEGIN
+        UPDATE discogs_releases
+        SET updated_at = CURRENT_TIMESTAMP
+        WHERE id = OLD.id;
+    END;
+"""
+
+# Outcome of the last artwork download ('saved' or 'failed'), so that failed
+# downloads are retried by the next import
+ADD_COLUMN_IMAGE_STATUS = "ALTER TABLE discogs_releases ADD COLUMN image_status TEXT;"
+
+# Checkpoints of Discogs imports: where each run has got to in the collection
+# listing, and the releases it has imported, so that a run that was stopped
+# can be resumed. A run is finished once its orphans have been cleaned up.
+CREATE_DISCOGS_IMPORT_RUNS_TABLE = """
+    CREATE TABLE IF NOT EXISTS discogs_import_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        total INTEGER NOT NULL,
+        page INTEGER NOT NULL DEFAULT 0,
+        position INTEGER NOT NULL DEFAULT 0,
+        started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT
+    );
+"""
+
+CREATE_DISCOGS_IMPORT_RUN_RELEASES_TABLE = """
+    CREATE TABLE IF NOT EXISTS discogs_import_run_releases (
+        run_id INTEGER NOT NULL,
+        discogs_id INTEGER NOT NULL,
+        PRIMARY KEY (run_id, discogs_id)
+    ) WITHOUT ROWID;
+"""
+
+# Restricts an aliased discogs_releases query to rows matching an FTS5 expression
+FTS_FILTER_SQL = "{alias}.id IN (SELECT rowid FROM discogs_releases_fts WHERE discogs_releases_fts MATCH ?)"
+
+
 def get_connection(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path)
     conn.row_factory = namedtuple_factory
     return conn
 
 
+def _migrate_baseline_schema(cur):
+    """Version 1: the schema as it was before versioning
+
+    Databases created by older releases already have the tables, but may lack
+    later columns, and carry indexes that duplicate others."""
+    cur.execute(CREATE_DISCOGS_RELEASES_TABLE)
+    cur.execute(CREATE_DISCOGS_RELEASES_TRIGGER)
+    cur.execute(CREATE_MB_MATCHES_TABLE)
+    cur.execute(CREATE_MB_MATCHES_TRIGGER)
+    cur.execute(CREATE_DISCOGS_OAUTH_TABLE)
+    cur.execute(CREATE_MB_CREDENTIALS_TABLE)
+
+    cur.execute("PRAGMA table_info(discogs_releases);")
+    columns = [row[1] for row in cur.fetchall()]
+    if "release_date_locked" not in columns:
+        cur.execute("ALTER TABLE discogs_releases ADD COLUMN release_date_locked INTEGER DEFAULT 0;")
+    if "play_count" not in columns:
+        cur.execute("ALTER TABLE discogs_releases ADD COLUMN play_count INTEGER DEFAULT 0;")
+    if "last_played" not in columns:
+        cur.execute("ALTER TABLE discogs_releases ADD COLUMN last_played TEXT;")
+
+    # Create indexes for performance
+    cur.execute(CREATE_IDX_RELEASE_DATE)
+    cur.execute(CREATE_IDX_MATCHES_MBID)
+    cur.execute(CREATE_IDX_MB_CREDENTIALS_USERNAME)
+    cur.execute(CREATE_IDX_SORT_NAME)
+    cur.execute(CREATE_IDX_ARTIST)
+    cur.execute(CREATE_IDX_TITLE)
+    cur.execute(CREATE_IDX_FORMAT)
+
+    # idx_mb_matches_mbid duplicates idx_matches_mbid, and the discogs_id
+    # indexes duplicate the ones SQLite creates for the UNIQUE constraints
+    for index_name in ('idx_mb_matches_mbid', 'idx_discogs_id', 'idx_matches_discogs_id'):
+        cur.execute(f"DROP INDEX IF EXISTS {index_name};")
+
+
+def _migrate_add_release_search(cur):
+    """Version 2: full-text search over artist, sort name, title, catalog numbers and barcodes"""
+    cur.execute(CREATE_DISCOGS_RELEASES_FTS_TABLE)
+    for trigger in CREATE_DISCOGS_RELEASES_FTS_TRIGGERS:
+        cur.execute(trigger)
+    cur.execute("INSERT INTO discogs_releases_fts (discogs_releases_fts) VALUES ('rebuild');")
+
+
+def _migrate_add_storage_format(cur):
+    """Version 3: indexed storage_format column for the format filters"""
+    cur.execute(ADD_COLUMN_STORAGE_FORMAT)
+    cur.execute(CREATE_IDX_STORAGE_FORMAT)
+
+
+def _migrate_add_release_date_parts(cur):
+    """Version 4: indexed year, month and day columns derived from release_date"""
+    for column in ADD_COLUMNS_RELEASE_DATE_PARTS:
+        cur.execute(column)
+    cur.execute(CREATE_IDX_RELEASE_YEAR)
+    cur.execute(CREATE_IDX_RELEASE_MONTH_DAY)
+
+
+def _migrate_add_discogs_fingerprint(cur):
+    """Version 5: listing fingerprint for incremental imports, and updated_at only for metadata changes"""
+    cur.execute(ADD_COLUMN_DISCOGS_FINGERPRINT)
+    cur.execute("DROP TRIGGER IF EXISTS update_discogs_releases_updatetime;")
+    cur.execute(CREATE_DISCOGS_RELEASES_METADATA_TRIGGER)
+
+
+def _migrate_add_image_status(cur):
+    """Version 6: outcome of the last artwork download"""
+    cur.execute(ADD_COLUMN_IMAGE_STATUS)
+
+
+def _migrate_add_import_checkpoints(cur):
+    """Version 7: checkpoints for resuming a stopped Discogs import"""
+    cur.execute(CREATE_DISCOGS_IMPORT_RUNS_TABLE)
+    cur.execute(CREATE_DISCOGS_IMPORT_RUN_RELEASES_TABLE)
+
+
+# Schema migrations, in order. The database's PRAGMA user_version records how
+# many have been applied; append new migrations, never edit applied ones.
+MIGRATIONS = [
+    _migrate_baseline_schema,
+    _migrate_add_release_search,
+    _migrate_add_storage_format,
+    _migrate_add_release_date_parts,
+    _migrate_add_discogs_fingerprint,
+    _migrate_add_image_status,
+    _migrate_add_import_checkpoints,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(db_path: str) -> int:
+    with context_manager(db_path) as cur:
+        cur.execute("PRAGMA user_version;")
+        return cur.fetchone()[0]
+
+
 def initialize_db(db_path: str) -> None:
     if not db_path:
         logger.critical('Missing db_path')
         exit()
 
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = get_connection(db_path)
-    cursor = conn.cursor()
 
-    logger.info("Initializing the database...")
+    # Fast path: a current schema needs no DDL at all
+    version = get_schema_version(db_path)
+    if version == SCHEMA_VERSION:
+        return
 
-    cursor.execute(CREATE_DISCOGS_RELEASES_TABLE)
-    cursor.execute(CREATE_DISCOGS_RELEASES_TRIGGER)
-    cursor.execute(CREATE_MB_MATCHES_TABLE)
-    cursor.execute(CREATE_MB_MATCHES_TRIGGER)
-    cursor.execute(CREATE_DISCOGS_OAUTH_TABLE)
-    cursor.execute(CREATE_MB_CREDENTIALS_TABLE)
+    if version > SCHEMA_VERSION:
+        logger.warning(f"Database schema version {version} is newer than this app supports ({SCHEMA_VERSION})")
+        return
 
-    # Create indexes for performance
-    cursor.execute(CREATE_IDX_DISCOGS_ID)
-    cursor.execute(CREATE_IDX_RELEASE_DATE)
-    cursor.execute(CREATE_IDX_MATCHES_DISCOGS_ID)
-    cursor.execute(CREATE_IDX_MATCHES_MBID)
-    cursor.execute(CREATE_IDX_MB_CREDENTIALS_USERNAME)
-    cursor.execute(CREATE_IDX_MB_MATCHES_MBID)
-    cursor.execute(CREATE_IDX_SORT_NAME)
-    cursor.execute(CREATE_IDX_ARTIST)
-    cursor.execute(CREATE_IDX_TITLE)
-    cursor.execute(CREATE_IDX_FORMAT)
-
-    conn.commit()
-    migrate_add_release_date_locked(db_path)
-    migrate_add_play_stats(db_path)
-    conn.close()
-
-
-def migrate_add_release_date_locked(db_path):
-    with context_manager(db_path) as cur:
-        cur.execute("PRAGMA table_info(discogs_releases);")
-        columns = [row[1] for row in cur.fetchall()]
-        if "release_date_locked" not in columns:
-            cur.execute("ALTER TABLE discogs_releases ADD COLUMN release_date_locked INTEGER DEFAULT 0;")
+    logger.info(f"Migrating the database from schema version {version} to {SCHEMA_VERSION}...")
 
+    # The GUI reads while the import and match workers write on their own connections.
+    # The journal mode cannot be changed inside a transaction.
+    thread_connection(db_path).execute("PRAGMA journal_mode=WAL;").fetchone()
 
-def migrate_add_play_stats(db_path):
-    with context_manager(db_path) as cur:
-        cur.execute("PRAGMA table_info(discogs_releases);")
-        columns = [row[1] for row in cur.fetchall()]
-        if "play_count" not in columns:
-            cur.execute("ALTER TABLE discogs_releases ADD COLUMN play_count INTEGER DEFAULT 0;")
-        if "last_played" not in columns:
-            cur.execute("ALTER TABLE discogs_releases ADD COLUMN last_played TEXT;")
+    with transaction(db_path):
+        with context_manager(db_path) as cur:
+            for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(cur)
+                cur.execute(f"PRAGMA user_version = {version};")
 
 
 def increment_play_stats(db_path: str, discogs_id: int):
@@ -173,35 +395,138 @@ def increment_play_stats(db_path: str, discogs_id: int):
         return cur.fetchone()
 
 
+def _thread_connections() -> dict:
+    connections = getattr(_thread_state, 'connections', None)
+    if connections is None:
+        connections = _thread_state.connections = {}
+        _thread_state.depths = {}
+    return connections
+
+
+def thread_connection(db_path: str, read_only: bool = False) -> sqlite3.Connection:
+    """Return this thread's connection to the database, opening it on first use"""
+    key = (db_path, read_only)
+    connections = _thread_connections()
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro',
+                               uri=True) if read_only else sqlite3.connect(db_path)
+        conn.row_factory = namedtuple_factory
+        connections[key] = conn
+        _thread_state.depths[key] = 0
+    return conn
+
+
+def close_thread_connections() -> None:
+    """Close every connection opened by the calling thread
+
+    Worker threads should call this when they finish."""
+    connections = _thread_connections()
+    for key, conn in list(connections.items()):
+        try:
+            if _thread_state.depths.get(key):
+                conn.rollback()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Error closing database connection: {e}")
+    connections.clear()
+    _thread_state.depths.clear()
+
+
+@contextmanager
+def transaction(db_path: str):
+    """Group statements into a single unit of work
+
+    context_manager() blocks inside the transaction share its connection and
+    do not commit. Everything is committed when the outermost transaction
+    exits, or rolled back if it raises."""
+    key = (db_path, False)
+    conn = thread_connection(db_path)
+    depths = _thread_state.depths
+    if depths[key] == 0 and not conn.in_transaction:
+        # Begin explicitly, so that reads and DDL are part of the unit of work too
+        conn.execute("BEGIN")
+    depths[key] += 1
+    try:
+        yield conn
+    except BaseException:
+        depths[key] -= 1
+        if depths[key] == 0:
+            conn.rollback()
+        raise
+    else:
+        depths[key] -= 1
+        if depths[key] == 0:
+            conn.commit()
+
+
 @contextmanager
 def context_manager(db_path: str, read_only: bool = False, namedtuple: bool = True):
-    """Wrapper to take care of committing and closing a database
+    """Wrapper to take care of committing a database cursor
+
+    The connection is reused for the lifetime of the calling thread. Inside a
+    transaction() the commit is left to the transaction.
 
     See https://stackoverflow.com/questions/67436362/decorator-for-sqlite3/67436763
     """
+    conn = thread_connection(db_path, read_only)
+    in_transaction = _thread_state.depths[(db_path, read_only)] > 0
+    cur = conn.cursor()
+    cur.row_factory = namedtuple_factory if namedtuple else sqlite3.Row
     try:
-        conn = sqlite3.connect(f'file:{db_path}?mode=ro',
-                               uri=True) if read_only else sqlite3.connect(db_path)
-
-        if namedtuple:
-            conn.row_factory = namedtuple_factory
-        else:
-            conn.row_factory = sqlite3.Row
-
-        cur = conn.cursor()
         yield cur
     except Exception as e:
         logger.error(f"Database error: {e}")
-        conn.rollback()
+        if not in_transaction:
+            conn.rollback()
         raise e
     else:
-        conn.commit()
+        if not in_transaction:
+            conn.commit()
     finally:
-        conn.close()
+        cur.close()
+
+
+@lru_cache(maxsize=256)
+def row_class(fields: tuple) -> type:
+    """Return the (shared) namedtuple class for a set of column names"""
+    return namedtuple("Row", fields)
+
+
+# The description and row class of the most recent query. A cursor returns the
+# same description object for every row of a result set, so an identity check
+# is enough to skip the cache lookup on all but the first row.
+_last_row_class = (None, None)
 
 
 def namedtuple_factory(cursor, row) -> namedtuple:
-    return namedtuple("Row", [column[0] for column in cursor.description])(*row)
+    global _last_row_class
+    description = cursor.description
+    last_description, cls = _last_row_class
+    if description is not last_description:
+        cls = row_class(tuple(column[0] for column in description))
+        _last_row_class = (description, cls)
+    return cls(*row)
+
+
+def fts_match_query(text: str, columns=None) -> str:
+    """Build an FTS5 query matching rows that contain every word of text
+
+    Each word is matched as a prefix, so partial words typed into a filter
+    box still match. If columns are given, only those columns are searched.
+    Returns None if text has no searchable words."""
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+
+    query = ' '.join(f'"{word}"*' for word in words)
+    if columns:
+        query = f"{{{' '.join(columns)}}} : ({query})"
+    return query
+
+
+def fts_filter_sql(alias: str = 'd') -> str:
+    return FTS_FILTER_SQL.format(alias=alias)
 
 
 def row_change(release_id: int, data_name: str, data_to: str, data_from: str) -> str:
@@ -1,20 +1,25 @@
 from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QComboBox, QDialogButtonBox
 from shared.utils import is_today_anniversary, is_month_anniversary, parse_and_humanize_date, humanize_date_delta
-from shared.db import context_manager, increment_play_stats
+from shared.db import context_manager, increment_play_stats, close_thread_connections
+from shared.collection import release_filters, fetch_releases, fetch_release, RandomReleasePicker
+from shared.thumbnails import ThumbnailService, TABLE_THUMBNAIL_SIZE, DETAIL_THUMBNAIL_SIZE
+from shared import images
 import musicbrainz.db_musicbrainz as db_musicbrainz
 from shared.config import AppConfig, GROOVEKRAFT_USER_AGENT, GROOVEKRAFT_VERSION
 from musicbrainz import mb_matcher, mb_auth_gui
 from discogs import discogs_importer
 from PyQt6.QtWidgets import (
-    QApplication, QLabel, QWidget, QVBoxLayout, QMainWindow, QTabWidget, QTextEdit, QTableWidget, QTableWidgetItem,
+    QApplication, QLabel, QWidget, QVBoxLayout, QMainWindow, QTabWidget, QTextEdit,
     QLineEdit, QHBoxLayout, QPushButton, QFormLayout, QGroupBox, QProgressBar, QDialog, QCheckBox, QStackedWidget,
-    QAbstractItemView
+    QAbstractItemView, QTableView, QHeaderView, QStyledItemDelegate, QStyleOptionViewItem, QStyle, QFileDialog
 )
-from PyQt6.QtGui import QKeySequence, QShortcut, QIcon
-from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QKeySequence, QShortcut, QIcon, QTextDocument
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QRectF, QSize
 from PyQt6.QtCore import QObject, pyqtSignal, QThread
 
 
+import itertools
+import math
 import os
 
 # Ensure SSL certificate bundle is available for HTTPS requests (e.g., MusicBrainz)
@@ -281,8 +286,181 @@ class ReleaseDateEditDialog(QDialog):
         return self.lock_checkbox.isChecked()
 
 
+# Screens of rows above and below the visible ones whose thumbnails are preloaded
+THUMBNAIL_PREFETCH_SCREENS = 2
+
+
+class ReleaseTableModel(QAbstractTableModel):
+    """Table model over the rows returned by shared.collection.fetch_releases
+
+    The rows are kept as fetched, and the HTML for the Details and Release Date
+    columns is built the first time a row is shown, so only rows that are
+    painted pay for formatting and date humanizing."""
+
+    COLUMNS = ['Artwork', 'Details', 'Release Date', 'Discogs Id', 'Matched']
+    ARTWORK, DETAILS, RELEASE_DATE, DISCOGS_ID, MATCHED = range(5)
+
+    LOCKED_TOOLTIP = "Release date is locked; cannot be changed by import."
+
+    def __init__(self, thumbnails, parent=None, artist_field='artist', headers=None):
+        super().__init__(parent)
+        self.thumbnails = thumbnails
+        self.artist_field = artist_field
+        self.headers = headers or self.COLUMNS
+        self._rows = []
+        self._html = {}
+        self._paths = {}
+        self._requested = {}
+        self.thumbnails.thumbnail_ready.connect(self._on_thumbnail_ready)
+
+    def set_rows(self, rows):
+        self.cancel_thumbnail_requests()
+        self.beginResetModel()
+        self._rows = rows
+        self._html = {}
+        self._paths = {}
+        self.endResetModel()
+
+    def release(self, row):
+        return self._rows[row]
+
+    def discogs_id(self, row):
+        return self._rows[row].discogs_id
+
+    def thumbnail(self, row):
+        path = self._paths.get(row)
+        if path is None:
+            return None
+        return self.thumbnails.cached(path, TABLE_THUMBNAIL_SIZE)
+
+    def request_thumbnail(self, row, path):
+        """Start loading a row's thumbnail from path; the row repaints when it arrives"""
+        self._paths[row] = path
+        pixmap = self.thumbnails.request(path, TABLE_THUMBNAIL_SIZE, owner=self)
+        if pixmap is None:
+            self._requested[path] = row
+        else:
+            self._thumbnail_changed(row)
+        return pixmap
+
+    def cancel_thumbnail_requests(self, keep=()):
+        """Skip the thumbnails requested by this model that have not started loading, except those in keep"""
+        for path in [path for path in self._requested if path not in keep]:
+            self.thumbnails.cancel(path, TABLE_THUMBNAIL_SIZE, owner=self)
+            del self._requested[path]
+
+    def _thumbnail_changed(self, row):
+        index = self.index(row, self.ARTWORK)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def _on_thumbnail_ready(self, path, size, _pixmap):
+        row = self._requested.pop(path, None)
+        if row is not None and size == TABLE_THUMBNAIL_SIZE:
+            self._thumbnail_changed(row)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def _row_html(self, row):
+        html = self._html.get(row)
+        if html is None:
+            release = self._rows[row]
+            artist = getattr(release, self.artist_field)
+            details_html = f"<b>{release.title}</b><br>{artist}<br>{release.format}<br>{release.country}"
+            release_human = parse_and_humanize_date(release.release_date)
+            release_delta = humanize_date_delta(release.release_date)
+            if release.release_date_locked:
+                release_html = f"<b>{release_human} 🔒</b><br>{release_delta}"
+            else:
+                release_html = f"<b>{release_human}</b><br>{release_delta}"
+            html = self._html[row] = (details_html, release_html)
+        return html
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        release = self._rows[row]
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == self.DETAILS:
+                return self._row_html(row)[0]
+            if column == self.RELEASE_DATE:
+                return self._row_html(row)[1]
+            if column == self.DISCOGS_ID:
+                return str(release.discogs_id)
+            if column == self.MATCHED:
+                return mb_matcher.score_stars(release.score if release.mbid else 0)
+        elif role == Qt.ItemDataRole.DecorationRole:
+            if column == self.ARTWORK:
+                return self.thumbnail(row)
+        elif role == Qt.ItemDataRole.TextAlignmentRole:
+            if column == self.DISCOGS_ID:
+                return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+            if column in (self.ARTWORK, self.MATCHED):
+                return Qt.AlignmentFlag.AlignCenter
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            if column == self.RELEASE_DATE and release.release_date_locked:
+                return self.LOCKED_TOOLTIP
+        return None
+
+
+class RichTextDelegate(QStyledItemDelegate):
+    """Paints a cell's DisplayRole value as HTML, like a QLabel with rich text"""
+
+    MARGIN = 10
+
+    def __init__(self, parent=None, word_wrap=True):
+        super().__init__(parent)
+        self.word_wrap = word_wrap
+
+    def _document(self, option, index):
+        doc = QTextDocument()
+        doc.setDocumentMargin(0)
+        doc.setDefaultFont(option.font)
+        doc.setHtml(index.data(Qt.ItemDataRole.DisplayRole) or '')
+        if self.word_wrap:
+            doc.setTextWidth(max(0, option.rect.width() - 2 * self.MARGIN))
+        return doc
+
+    def paint(self, painter, option, index):
+        options = QStyleOptionViewItem(option)
+        self.initStyleOption(options, index)
+        doc = self._document(options, index)
+
+        # Let the style draw the background and selection, without the text
+        options.text = ''
+        style = options.widget.style() if options.widget else QApplication.style()
+        style.drawControl(QStyle.ControlElement.CE_ItemViewItem, options, painter, options.widget)
+
+        text_rect = options.rect.adjusted(self.MARGIN, 0, -self.MARGIN, 0)
+        top = text_rect.top() + max(0, (text_rect.height() - doc.size().height()) / 2)
+        painter.save()
+        painter.translate(text_rect.left(), top)
+        painter.setClipRect(QRectF(0, 0, text_rect.width(), text_rect.height()))
+        doc.drawContents(painter)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        doc = QTextDocument()
+        doc.setDocumentMargin(0)
+        doc.setDefaultFont(option.font)
+        doc.setHtml(index.data(Qt.ItemDataRole.DisplayRole) or '')
+        return QSize(math.ceil(doc.idealWidth()) + 2 * self.MARGIN + 1, math.ceil(doc.size().height()))
+
+
 class CollectionViewer(QMainWindow):
     def refresh_views(self):
+        if getattr(self, "random_picker", None):
+            self.random_picker.invalidate()
         if getattr(self, "populate_collection_table_fn", None):
             self.populate_collection_table_fn()
         if getattr(self, "populate_on_this_day_table_fn", None):
@@ -298,6 +476,32 @@ class CollectionViewer(QMainWindow):
     def reset_escape_handler(self):
         self.set_escape_handler(self.close)
 
+    def create_release_table(self, model):
+        table = QTableView()
+        table.setModel(model)
+        table.setItemDelegateForColumn(ReleaseTableModel.DETAILS, RichTextDelegate(table))
+        table.setItemDelegateForColumn(ReleaseTableModel.RELEASE_DATE, RichTextDelegate(table, word_wrap=False))
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        # Fixed row heights to fit thumbnails, and column widths sized from the
+        # visible rows only, so neither walks the whole model
+        table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        table.verticalHeader().setDefaultSectionSize(110)
+        table.horizontalHeader().setResizeContentsPrecision(0)
+        # Thumbnails arrive after the columns are sized, so reserve their width
+        table.horizontalHeader().setMinimumSectionSize(0)
+        table.setColumnWidth(ReleaseTableModel.ARTWORK, TABLE_THUMBNAIL_SIZE + 10)
+        table.horizontalHeader().setSectionResizeMode(ReleaseTableModel.ARTWORK, QHeaderView.ResizeMode.Fixed)
+        self.apply_detail_table_affordances(table)
+        return table
+
+    @staticmethod
+    def resize_release_columns(table):
+        # The Artwork column keeps the width reserved for thumbnails, which
+        # have not arrived when the other columns are sized
+        for column in range(table.model().columnCount()):
+            if column != ReleaseTableModel.ARTWORK:
+                table.resizeColumnToContents(column)
+
     @staticmethod
     def apply_detail_table_affordances(table):
         table.setToolTip("Click a row to view details")
@@ -305,7 +509,7 @@ class CollectionViewer(QMainWindow):
         table.setFocusPolicy(Qt.FocusPolicy.NoFocus)
         table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         table.setStyleSheet(
-            "QTableWidget::item:selected { background: #dbe9ff; color: #000; }"
+            "QTableView::item:selected { background: #dbe9ff; color: #000; }"
         )
 
     def build_detail_page(self, back_callback):
@@ -330,21 +534,20 @@ class CollectionViewer(QMainWindow):
 
         return page, detail_widget, image_label
 
-    def get_release_detail(self, discogs_id):
-        with context_manager(self.cfg.db_path) as cur:
-            cur.execute("""
-                SELECT artist, title, format, country, release_date, release_date_locked, discogs_id,
-                       catnos, barcodes, play_count, last_played
-                FROM discogs_releases
-                WHERE discogs_id = ?
-            """, (discogs_id,))
-            release = cur.fetchone()
+    def image_path(self, discogs_id):
+        return images.image_path(self.cfg.images_folder, discogs_id)
+
+    def thumbnail_file(self, discogs_id, size):
+        """Return the pre-generated thumbnail of a release, or its original artwork, or None"""
+        return (self.image_manifest.thumbnail_path(discogs_id, size)
+                or self.image_manifest.image_path(discogs_id))
 
+    def get_release_detail(self, discogs_id):
+        release = fetch_release(self.cfg.db_path, discogs_id)
         if not release:
             return None
 
-        mb_row = db_musicbrainz.fetch_row(self.cfg.db_path, discogs_id=discogs_id)
-        matched = bool(mb_row and mb_row.mbid)
+        matched = bool(release.mbid)
 
         release_human = parse_and_humanize_date(release.release_date)
         locked = bool(getattr(release, "release_date_locked", 0))
@@ -363,8 +566,7 @@ class CollectionViewer(QMainWindow):
             'Last Played': getattr(release, "last_played", None)
         }
 
-        image_path = os.path.join(self.cfg.images_folder, f"{discogs_id}.jpg")
-        return data, image_path
+        return data, self.image_path(discogs_id)
 
     def show_release_detail(self, discogs_id, detail_widget, image_label=None):
         details = self.get_release_detail(discogs_id)
@@ -375,15 +577,31 @@ class CollectionViewer(QMainWindow):
         detail_widget.update_data(data)
 
         if image_label is not None:
-            if os.path.exists(image_path):
-                from PyQt6.QtGui import QPixmap
-                pixmap = QPixmap(image_path)
-                pixmap = pixmap.scaled(image_label.width() or 320, image_label.height() or 320,
-                                       Qt.AspectRatioMode.KeepAspectRatio,
-                                       Qt.TransformationMode.SmoothTransformation)
+            self.show_detail_image(image_label, self.thumbnail_file(discogs_id, DETAIL_THUMBNAIL_SIZE))
+
+    def show_detail_image(self, image_label, path):
+        """Show an image in a detail view's label, decoding it on the thumbnail pool if it is not cached"""
+        pending = self._detail_images.pop(image_label, None)
+        if pending is not None:
+            # The label has moved on to another release
+            self.thumbnails.cancel(*pending, owner=image_label)
+
+        pixmap = None
+        if path:
+            size = max(image_label.width(), image_label.height()) or 320
+            pixmap = self.thumbnails.request(path, size, owner=image_label)
+            if pixmap is None:
+                self._detail_images[image_label] = (path, size)
+        if pixmap is not None:
+            image_label.setPixmap(pixmap)
+        else:
+            image_label.clear()
+
+    def _on_detail_image_ready(self, path, size, pixmap):
+        for image_label, pending in list(self._detail_images.items()):
+            if pending == (path, size):
+                del self._detail_images[image_label]
                 image_label.setPixmap(pixmap)
-            else:
-                image_label.clear()
 
     def handle_play_now(self, discogs_id, detail_widget, image_label=None):
         if discogs_id is None:
@@ -427,28 +645,18 @@ class CollectionViewer(QMainWindow):
         if refresh_tables:
             self.refresh_views()
 
-    @staticmethod
-    def storage_format_case_sql(alias="d"):
-        normalized = f"LOWER(REPLACE(REPLACE({alias}.format, '”', '\"'), '“', '\"'))"
-        return (
-            "CASE "
-            f"WHEN {normalized} LIKE '%cd%' THEN 'Compact Disc' "
-            f"WHEN {normalized} LIKE '%box set%' AND {normalized} LIKE '%vinyl%' THEN '12\" vinyl' "
-            f"WHEN {normalized} LIKE '%box set%' THEN 'Compact Disc' "
-            f"WHEN {normalized} LIKE '%vinyl%' AND ({normalized} LIKE '%7\"%' OR {normalized} LIKE '%7 inch%') THEN '7\" vinyl' "
-            f"WHEN {normalized} LIKE '%vinyl%' THEN '12\" vinyl' "
-            "ELSE NULL END"
-        )
-
     class DiscogsImportWorker(QObject):
         progress_msg = pyqtSignal(str)
         finished = pyqtSignal()
         progress = pyqtSignal(int)
 
-        def __init__(self, client, cfg):
+        def __init__(self, client, cfg, image_manifest=None, full_refresh=False, resume=False):
             super().__init__()
             self.client = client
             self.cfg = cfg
+            self.image_manifest = image_manifest
+            self.full_refresh = full_refresh
+            self.resume = resume
             self._cancel_requested = False
 
         def cancel(self):
@@ -465,10 +673,49 @@ class CollectionViewer(QMainWindow):
                     cfg=self.cfg,
                     callback=emit_msg,
                     should_cancel=lambda: self._cancel_requested,
-                    progress_callback=lambda pct: self.progress.emit(pct)
+                    progress_callback=lambda pct: self.progress.emit(pct),
+                    image_manifest=self.image_manifest,
+                    full_refresh=self.full_refresh,
+                    resume=self.resume
+                )
+            except Exception as e:
+                self.progress_msg.emit(f"Error: {e}")
+            finally:
+                close_thread_connections()
+            self.finished.emit()
+
+    class DiscogsFileImportWorker(QObject):
+        progress_msg = pyqtSignal(str)
+        finished = pyqtSignal()
+        progress = pyqtSignal(int)
+
+        def __init__(self, path, cfg):
+            super().__init__()
+            self.path = path
+            self.cfg = cfg
+            self._cancel_requested = False
+
+        def cancel(self):
+            self._cancel_requested = True
+
+        def run(self):
+            from discogs import discogs_file_importer, discogs_dump_importer
+            if discogs_dump_importer.is_dump(self.path):
+                import_from_file = discogs_dump_importer.import_from_dump
+            else:
+                import_from_file = discogs_file_importer.import_from_file
+            try:
+                import_from_file(
+                    cfg=self.cfg,
+                    path=self.path,
+                    callback=self.progress_msg.emit,
+                    should_cancel=lambda: self._cancel_requested,
+                    progress_callback=self.progress.emit
                 )
             except Exception as e:
                 self.progress_msg.emit(f"Error: {e}")
+            finally:
+                close_thread_connections()
             self.finished.emit()
 
     def __init__(self, cfg: AppConfig):
@@ -478,6 +725,11 @@ class CollectionViewer(QMainWindow):
         if not hasattr(self.cfg, "images_folder"):
             self.cfg.images_folder = os.path.join(self.cfg.root_folder, "images")
         self.setMinimumSize(800, 600)
+        self.thumbnails = ThumbnailService(self)
+        # The image each detail view's label is waiting for, as (path, size)
+        self._detail_images = {}
+        self.thumbnails.thumbnail_ready.connect(self._on_detail_image_ready)
+        self.image_manifest = images.ImageManifest(self.cfg.images_folder)
         tab_widget = QTabWidget()
 
         # Initialize references for later use
@@ -687,10 +939,12 @@ class CollectionViewer(QMainWindow):
 
         update_date_label()
 
-        table = QTableWidget()
+        model = ReleaseTableModel(
+            self.thumbnails, self, artist_field='sort_name',
+            headers=['Thumbnail', 'Details', 'Release Date', 'Discogs Id', 'Matched'])
+        table = self.create_release_table(model)
         layout.addWidget(table)
         self.on_this_day_table = table
-        self.apply_detail_table_affordances(table)
 
         def back_to_list():
             stack.setCurrentWidget(list_page)
@@ -707,137 +961,39 @@ class CollectionViewer(QMainWindow):
             ))
         stack.addWidget(detail_page)
 
-        def open_detail_view(row_idx, _column):
-            discogs_id_item = table.item(row_idx, 3)
-            if discogs_id_item:
-                discogs_id = int(discogs_id_item.text())
+        def open_detail_view(index):
+            if index.isValid():
+                discogs_id = model.discogs_id(index.row())
                 self.show_release_detail(discogs_id, self.on_this_day_detail_widget, self.on_this_day_image_label)
                 stack.setCurrentWidget(detail_page)
                 self.set_escape_handler(back_to_list)
 
         # Single/double click -> open detail view
-        table.cellClicked.connect(open_detail_view)
-        table.cellDoubleClicked.connect(open_detail_view)
+        table.clicked.connect(open_detail_view)
+        table.doubleClicked.connect(open_detail_view)
 
         # The logic for populating the table
         def populate_on_this_day_table():
-            # placeholder filters
-            find_filter = ''
-            format_filter = ''
-
-            with context_manager(self.cfg.db_path, namedtuple=False) as cur:
-                query = []
-                query.append(
-                    'SELECT d.sort_name AS artist, d.title, d.format, d.country, d.release_date, d.discogs_id')
-                query.append('FROM discogs_releases d')
-                query.append('LEFT JOIN mb_matches m USING(discogs_id)')
-                query.append('WHERE d.release_date IS NOT NULL')
-                if find_filter:
-                    query.append(f'AND (d.artist LIKE "%{find_filter}%"')
-                    query.append(f'OR d.title LIKE "%{find_filter}%"')
-                    query.append(f'OR d.sort_name LIKE "%{find_filter}%")')
-                if format_filter:
-                    query.append(f'AND d.format LIKE "%{format_filter}%"')
-                query.append(
-                    'ORDER BY length(d.release_date) DESC, d.release_date, d.sort_name, d.title, d.discogs_id')
-                cur.execute(' '.join(query))
-                items = cur.fetchall()
-
-            # Filter rows using the currently selected month/day only
-            from PyQt6.QtCore import QDate
-            target_month = current_month
-            target_day = current_day
             update_date_label()
 
-            rows = []
-            for item in items:
-                rd = item["release_date"]
-                include = False
-                if rd:
-                    if len(rd) == 10 and '-' in rd:
-                        # YYYY-MM-DD: match month & day with target
-                        try:
-                            y, m, d = map(int, rd.split('-'))
-                            qd = QDate(y, m, d)
-                            if qd.isValid() and m == target_month and d == target_day:
-                                include = True
-                        except Exception:
-                            include = False
-                    elif len(rd) == 7 and '-' in rd:
-                        # YYYY-MM: match month with target
-                        try:
-                            y, m = rd.split('-')
-                            y = int(y)
-                            m = int(m)
-                            if 1 <= m <= 12 and 1900 <= y <= 2100 and m == target_month:
-                                include = True
-                        except Exception:
-                            include = False
-                if include:
-                    rows.append(item)
-
-            # Set up table to match Collection tab structure
-            table.setColumnCount(5)
-            table.setHorizontalHeaderLabels(
-                ['Thumbnail', 'Details', 'Release Date', 'Discogs Id', 'Matched'])
-            table.setRowCount(len(rows))
-            table.verticalHeader().setDefaultSectionSize(110)
+            # Full dates match on month and day, month-only dates on month alone
+            rows = fetch_releases(
+                self.cfg.db_path,
+                ['d.release_month = ?',
+                 '(d.release_day = ? OR (d.release_day IS NULL AND length(d.release_date) = 7'
+                 ' AND d.release_year BETWEEN 1900 AND 2100))'],
+                (current_month, current_day),
+                order_by='length(d.release_date) DESC, d.release_date, d.sort_name, d.title, d.discogs_id')
+
+            model.set_rows(rows)
 
             for row_idx, item in enumerate(rows):
-                artist = item["artist"]
-                title = item["title"]
-                format = item["format"]
-                country = item["country"]
-                release_date = item["release_date"]
-                discogs_id = item["discogs_id"]
-                # Column 0: Thumbnail
-                image_path = os.path.join(self.cfg.images_folder, f"{discogs_id}.jpg")
-                if os.path.exists(image_path):
-                    from PyQt6.QtGui import QPixmap
-                    pixmap = QPixmap(image_path)
-                    pixmap = pixmap.scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio,
-                                           Qt.TransformationMode.SmoothTransformation)
-                    thumbnail_item = QTableWidgetItem()
-                    thumbnail_item.setData(Qt.ItemDataRole.DecorationRole, pixmap)
-                    thumbnail_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                    table.setItem(row_idx, 0, thumbnail_item)
-
-                # Column 1: Details (QLabel with HTML, similar to Collection tab)
-                details_html = f"<b>{title}</b><br>{artist}<br>{format}<br>{country}"
-                details_label = QLabel()
-                details_label.setText(details_html)
-                details_label.setAlignment(Qt.AlignmentFlag.AlignLeft |
-                                           Qt.AlignmentFlag.AlignVCenter)
-                details_label.setWordWrap(True)
-                details_label.setContentsMargins(10, 0, 10, 0)
-                table.setCellWidget(row_idx, 1, details_label)
-
-                # Column 2: Release Date (two lines, no wrapping within a line)
-                release_text = f"<b>{parse_and_humanize_date(release_date)}</b><br>{humanize_date_delta(release_date)}"
-                release_label = QLabel()
-                release_label.setText(release_text)
-                release_label.setAlignment(Qt.AlignmentFlag.AlignLeft |
-                                           Qt.AlignmentFlag.AlignVCenter)
-                release_label.setWordWrap(False)
-                release_label.setContentsMargins(10, 0, 10, 0)
-                table.setCellWidget(row_idx, 2, release_label)
-
-                # Column 3: Discogs Id (right aligned)
-                table.setItem(row_idx, 3, QTableWidgetItem(str(discogs_id)))
-                table.item(row_idx, 3).setTextAlignment(
-                    Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-
-                # Column 4: Matched (show stars)
-                mb_row = db_musicbrainz.fetch_row(self.cfg.db_path, discogs_id=discogs_id)
-                score = mb_row.score if mb_row and mb_row.score is not None else 0
-                match_star = mb_matcher.score_stars(score)
-                match_item = QTableWidgetItem(match_star)
-                match_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                table.setItem(row_idx, 4, match_item)
-
-            table.resizeColumnsToContents()
-
-        table.cellDoubleClicked.connect(open_detail_view)
+                # Column 0: Thumbnail, loaded in the background
+                path = self.thumbnail_file(item.discogs_id, TABLE_THUMBNAIL_SIZE)
+                if path:
+                    model.request_thumbnail(row_idx, path)
+
+            self.resize_release_columns(table)
 
         # Navigation handlers: move selected month/day (no year) and repopulate
         def goto_prev_day():
@@ -931,10 +1087,10 @@ class CollectionViewer(QMainWindow):
         filter_layout.addWidget(clear_button)
 
         # Table
-        table = QTableWidget()
+        model = ReleaseTableModel(self.thumbnails, self)
+        table = self.create_release_table(model)
         list_layout.addWidget(table)
         self.collection_table = table
-        self.apply_detail_table_affordances(table)
 
         def back_to_list():
             stack.setCurrentWidget(list_page)
@@ -961,8 +1117,7 @@ class CollectionViewer(QMainWindow):
         last_filter_values = None
 
         def populate_table():
-            nonlocal resize_done, last_filter_values
-            storage_format_case = self.storage_format_case_sql("d")
+            nonlocal last_filter_values
             current_filters = {
                 "artist": artist_input.text(),
                 "title": title_input.text(),
@@ -973,116 +1128,19 @@ class CollectionViewer(QMainWindow):
             if last_filter_values is not None and current_filters == last_filter_values:
                 return  # No real change, skip repopulating
             last_filter_values = current_filters
-            resize_done = False
             table.setUpdatesEnabled(False)
-            with context_manager(self.cfg.db_path) as cur:
-                query = []
-                params = []
-
-                # Now also fetch d.release_date_locked
-                query.append(
-                    "SELECT d.sort_name, d.artist, d.title, d.format, d.country, d.release_date, d.release_date_locked, d.discogs_id, m.mbid")
-                query.append("FROM discogs_releases d")
-                query.append("LEFT JOIN mb_matches m USING(discogs_id)")
-                filters = []
-
-                if artist_input.text():
-                    filters.append('d.sort_name LIKE ?')
-                    params.append(f"%{artist_input.text()}%")
-                if title_input.text():
-                    filters.append('d.title LIKE ?')
-                    params.append(f"%{title_input.text()}%")
-                if storage_format_combo.currentData():
-                    filters.append(f"{storage_format_case} = ?")
-                    params.append(storage_format_combo.currentData())
-                if year_from_input.text():
-                    filters.append('substr(d.release_date, 1, 4) >= ?')
-                    params.append(year_from_input.text())
-                if year_to_input.text():
-                    filters.append('substr(d.release_date, 1, 4) <= ?')
-                    params.append(year_to_input.text())
-
-                if filters:
-                    query.append("WHERE " + " AND ".join(filters))
-
-                query.append("ORDER BY d.sort_name, d.release_date, d.title, d.discogs_id")
-                cur.execute(' '.join(query), params)
-                rows = cur.fetchall()
-
-            # Update table columns and headers to new format
-            table.setColumnCount(5)
-            table.setHorizontalHeaderLabels(
-                ['Artwork', 'Details', 'Release Date', 'Discogs Id', 'Matched'])
-            table.setRowCount(len(rows))
-            # Set row height to fit thumbnails
-            table.verticalHeader().setDefaultSectionSize(110)
-
-            for row_idx, row in enumerate(rows):
-                # Unpack and handle release_date_locked
-                # (sort_name, artist, title, format, country, release_date, release_date_locked, discogs_id, mbid)
-                (sort_name, artist, title, format, country, release_date,
-                 release_date_locked, discogs_id, mbid) = row
-
-                # Column 0: Artwork (empty QTableWidgetItem for lazy thumbnail loading)
-                thumbnail_item = QTableWidgetItem()
-                table.setItem(row_idx, 0, thumbnail_item)
-
-                # Column 1: Details (QLabel with HTML)
-                details_html = f"<b>{title}</b><br>{artist}<br>{format}<br>{country}"
-                details_label = QLabel()
-                details_label.setText(details_html)
-                details_label.setAlignment(Qt.AlignmentFlag.AlignLeft |
-                                           Qt.AlignmentFlag.AlignVCenter)
-                details_label.setWordWrap(True)
-                details_label.setContentsMargins(10, 0, 10, 0)
-                table.setCellWidget(row_idx, 1, details_label)
-
-                # Column 2: Release Date (two lines, no wrapping within a line)
-                release_human = parse_and_humanize_date(release_date)
-                release_delta = humanize_date_delta(release_date)
-                locked = bool(release_date_locked) if release_date_locked is not None else False
-                if locked:
-                    release_text = f"<b>{release_human} 🔒</b><br>{release_delta}"
-                else:
-                    release_text = f"<b>{release_human}</b><br>{release_delta}"
-                release_label = QLabel()
-                release_label.setText(release_text)
-                release_label.setAlignment(Qt.AlignmentFlag.AlignLeft |
-                                           Qt.AlignmentFlag.AlignVCenter)
-                release_label.setWordWrap(False)
-                release_label.setContentsMargins(10, 0, 10, 0)
-                if locked:
-                    release_label.setToolTip("Release date is locked; cannot be changed by import.")
-                table.setCellWidget(row_idx, 2, release_label)
-
-                # Column 3: Discogs Id
-                table.setItem(row_idx, 3, QTableWidgetItem(str(discogs_id)))
-                table.item(row_idx, 3).setTextAlignment(
-                    Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-
-                # Column 4: Matched (centered)
-                if mbid:
-                    mb_row = db_musicbrainz.fetch_row(self.cfg.db_path, discogs_id=discogs_id)
-                    score = mb_row.score if mb_row and mb_row.score is not None else 0
-                else:
-                    score = 0
+            filters, params = release_filters(
+                artist=artist_input.text(),
+                title=title_input.text(),
+                storage_format=storage_format_combo.currentData(),
+                year_from=year_from_input.text(),
+                year_to=year_to_input.text())
+            rows = fetch_releases(self.cfg.db_path, filters, params)
 
-                match_star = mb_matcher.score_stars(score)
-                match_item = QTableWidgetItem(match_star)
-                match_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                table.setItem(row_idx, 4, match_item)
+            model.set_rows(rows)
 
-            table.resizeColumnsToContents()
+            self.resize_release_columns(table)
             table.setUpdatesEnabled(True)
-            table.repaint()
-
-            # Ensure click handlers are not connected multiple times
-            for signal in (table.cellClicked, table.cellDoubleClicked):
-                try:
-                    signal.disconnect()
-                except TypeError:
-                    pass
-                signal.connect(lambda row, col, tbl=table: on_table_double_click(row, col, tbl))
 
             # Call lazy thumbnail loader after populating table
             load_visible_thumbnails()
@@ -1090,53 +1148,63 @@ class CollectionViewer(QMainWindow):
         # Connect filter_timer to call populate_table (debounced)
         filter_timer.timeout.connect(populate_table)
 
-        # Lazy load thumbnails for visible rows only (with column resize on first load)
-        resize_done = False
-
+        # Lazy load thumbnails for the visible rows, then a few screens either side
         def load_visible_thumbnails():
-            nonlocal resize_done
-            viewport_rect = table.viewport().rect()
-            visible_rows_loaded = 0
-
-            for row in range(table.rowCount()):
-                item = table.item(row, 0)
-                if not item:
-                    continue
-                rect = table.visualItemRect(item)
-                if viewport_rect.intersects(rect):
-                    if item.data(Qt.ItemDataRole.DecorationRole) is None:
-                        discogs_id_item = table.item(row, 3)
-                        if discogs_id_item:
-                            discogs_id = discogs_id_item.text()
-                            image_path = os.path.join(self.cfg.images_folder, f"{discogs_id}.jpg")
-                            if os.path.exists(image_path):
-                                from PyQt6.QtGui import QPixmap
-                                pixmap = QPixmap(image_path)
-                                pixmap = pixmap.scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio,
-                                                       Qt.TransformationMode.SmoothTransformation)
-                                item.setData(Qt.ItemDataRole.DecorationRole, pixmap)
-                                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                visible_rows_loaded += 1
-
-            if not resize_done and visible_rows_loaded > 0:
-                table.resizeColumnsToContents()
-                resize_done = True
+            row_count = model.rowCount()
+            if row_count == 0:
+                return
+
+            first = table.rowAt(0)
+            last = table.rowAt(table.viewport().height() - 1)
+            first = max(first, 0)
+            last = row_count - 1 if last < 0 else last
+            prefetch = (last - first + 1) * THUMBNAIL_PREFETCH_SCREENS
+
+            rows = itertools.chain(
+                range(first, last + 1),
+                range(last + 1, min(last + 1 + prefetch, row_count)),
+                range(first - 1, max(first - 1 - prefetch, -1), -1))
+            wanted = {}
+            for row in rows:
+                if model.thumbnail(row) is None:
+                    path = self.thumbnail_file(model.discogs_id(row), TABLE_THUMBNAIL_SIZE)
+                    if path:
+                        wanted[path] = row
+
+            # Drop decodes queued for rows that have scrolled out of range,
+            # leaving those still wanted in the queue
+            model.cancel_thumbnail_requests(keep=wanted)
+            for path, row in wanted.items():
+                model.request_thumbnail(row, path)
+
+        # Coalesce scroll ticks, and wait while the scrollbar is being dragged
+        thumbnail_timer = QTimer()
+        thumbnail_timer.setSingleShot(True)
+        thumbnail_timer.setInterval(50)
+        thumbnail_timer.timeout.connect(load_visible_thumbnails)
+
+        def on_scroll():
+            if not table.verticalScrollBar().isSliderDown():
+                thumbnail_timer.start()
 
         # Connect vertical scrollbar to lazy thumbnail loader
         def connect_scrollbar():
             scrollbar = table.verticalScrollBar()
-            scrollbar.valueChanged.connect(load_visible_thumbnails)
+            scrollbar.valueChanged.connect(on_scroll)
+            scrollbar.sliderReleased.connect(thumbnail_timer.start)
 
-        # Define double-click handler for detail view
-        def on_table_double_click(row, column, table):
-            discogs_id_item = table.item(row, 3)
-            if not discogs_id_item:
+        # Define click handler for detail view
+        def on_table_double_click(index):
+            if not index.isValid():
                 return
-            discogs_id = int(discogs_id_item.text())
+            discogs_id = model.discogs_id(index.row())
             self.show_release_detail(discogs_id, self.collection_detail_widget, self.collection_image_label)
             stack.setCurrentWidget(detail_page)
             self.set_escape_handler(back_to_list)
 
+        table.clicked.connect(on_table_double_click)
+        table.doubleClicked.connect(on_table_double_click)
+
         # Connect filter changes to start the debounce timer instead of calling populate_table directly
         artist_input.textChanged.connect(lambda: filter_timer.start())
         title_input.textChanged.connect(lambda: filter_timer.start())
@@ -1156,11 +1224,17 @@ class CollectionViewer(QMainWindow):
 
         clear_button.clicked.connect(clear_filters)
 
+        def refresh_table():
+            # The rows or their artwork may have changed under unchanged filters
+            nonlocal last_filter_values
+            last_filter_values = None
+            populate_table()
+
         # Connect scrollbar after widget is shown and table is created
         QTimer.singleShot(500, populate_table)
         QTimer.singleShot(600, connect_scrollbar)
         # Store the populate function for refresh_views
-        self.populate_collection_table_fn = populate_table
+        self.populate_collection_table_fn = refresh_table
         return widget
 
     def create_randomiser_tab(self):
@@ -1253,80 +1327,50 @@ class CollectionViewer(QMainWindow):
         random_button_layout.addStretch()
         main_layout.addLayout(random_button_layout)
 
-        storage_format_case = self.storage_format_case_sql("d")
+        self.random_picker = RandomReleasePicker(self.cfg.db_path)
 
         def load_random_item():
-            # Build filter fragments and params identical to Collection tab
-            where_clauses = []
-            params = []
-            if r_artist_input.text():
-                where_clauses.append('d.sort_name LIKE ?')
-                params.append(f"%{r_artist_input.text()}%")
-            if r_title_input.text():
-                where_clauses.append('d.title LIKE ?')
-                params.append(f"%{r_title_input.text()}%")
-            if r_storage_format_combo.currentData():
-                where_clauses.append(f"{storage_format_case} = ?")
-                params.append(r_storage_format_combo.currentData())
-            if r_year_from_input.text():
-                where_clauses.append('substr(d.release_date, 1, 4) >= ?')
-                params.append(r_year_from_input.text())
-            if r_year_to_input.text():
-                where_clauses.append('substr(d.release_date, 1, 4) <= ?')
-                params.append(r_year_to_input.text())
-
-            with context_manager(self.cfg.db_path) as cur:
-                # First update the count label
-                count_sql = [
-                    'SELECT COUNT(*) AS cnt FROM discogs_releases d',
-                ]
-                if where_clauses:
-                    count_sql.append('WHERE ' + ' AND '.join(where_clauses))
-                cur.execute(' '.join(count_sql), params)
-                count_row = cur.fetchone()
-                total = int(count_row.cnt) if count_row and hasattr(count_row, 'cnt') else 0
-                # Update button label, enable/disable, tooltip, and size
-                random_button.setText(f"🎲 Randomise ({total})")
-                random_button.setEnabled(total > 0)
-                # Tooltip with proper pluralisation
-                tooltip_count = "1 matching release" if total == 1 else f"{total} matching releases"
-                random_button.setToolTip(f"Randomly pick from {tooltip_count}")
-                random_button.adjustSize()
-
-                # Show/hide content areas based on count
-                if total == 0:
-                    self.random_image_label.setVisible(False)
-                    self.random_detail_widget.setVisible(False)
-                else:
-                    self.random_image_label.setVisible(True)
-                    self.random_detail_widget.setVisible(True)
-
-                if total == 0:
-                    # Clear UI when nothing matches
-                    self.random_image_label.clear()
-                    self.random_detail_widget.update_data({
-                        'Artist': '', 'Title': 'No matching release', 'Format': '', 'Country': '',
-                        'Release Date': '', 'Discogs Id': '', 'Catalog Numbers': '', 'Barcodes': '', 'Matched': ''
-                    })
-                    self.random_image_label.setVisible(False)
-                    self.random_detail_widget.setVisible(False)
-                    return
-
-                # Then fetch a single random row that matches the filters
-                select_sql = [
-                    'SELECT d.artist, d.title, d.format, d.country, d.release_date, d.discogs_id, d.catnos, d.barcodes, m.mbid',
-                    'FROM discogs_releases d',
-                    'LEFT JOIN mb_matches m USING(discogs_id)'
-                ]
-                if where_clauses:
-                    select_sql.append('WHERE ' + ' AND '.join(where_clauses))
-                select_sql.append('ORDER BY RANDOM() LIMIT 1')
-                cur.execute(' '.join(select_sql), params)
-                row = cur.fetchone()
-
-                if row:
-                    discogs_id = row.discogs_id
-                    self.show_release_detail(discogs_id, self.random_detail_widget, self.random_image_label)
+            # Same filters as the Collection tab
+            where_clauses, params = release_filters(
+                artist=r_artist_input.text(),
+                title=r_title_input.text(),
+                storage_format=r_storage_format_combo.currentData(),
+                year_from=r_year_from_input.text(),
+                year_to=r_year_to_input.text())
+
+            # Update the count label
+            total = self.random_picker.count(where_clauses, params)
+            # Update button label, enable/disable, tooltip, and size
+            random_button.setText(f"🎲 Randomise ({total})")
+            random_button.setEnabled(total > 0)
+            # Tooltip with proper pluralisation
+            tooltip_count = "1 matching release" if total == 1 else f"{total} matching releases"
+            random_button.setToolTip(f"Randomly pick from {tooltip_count}")
+            random_button.adjustSize()
+
+            # Show/hide content areas based on count
+            if total == 0:
+                self.random_image_label.setVisible(False)
+                self.random_detail_widget.setVisible(False)
+            else:
+                self.random_image_label.setVisible(True)
+                self.random_detail_widget.setVisible(True)
+
+            if total == 0:
+                # Clear UI when nothing matches
+                self.random_image_label.clear()
+                self.random_detail_widget.update_data({
+                    'Artist': '', 'Title': 'No matching release', 'Format': '', 'Country': '',
+                    'Release Date': '', 'Discogs Id': '', 'Catalog Numbers': '', 'Barcodes': '', 'Matched': ''
+                })
+                self.random_image_label.setVisible(False)
+                self.random_detail_widget.setVisible(False)
+                return
+
+            # Then pick a single random release that matches the filters
+            discogs_id = self.random_picker.pick(where_clauses, params)
+            if discogs_id is not None:
+                self.show_release_detail(discogs_id, self.random_detail_widget, self.random_image_label)
 
         random_button.clicked.connect(load_random_item)
 
@@ -1357,6 +1401,18 @@ class CollectionViewer(QMainWindow):
         widget = QWidget()
         layout = QVBoxLayout(widget)
 
+        # Unchecked, only releases changed since the last import are fetched
+        full_refresh_checkbox = QCheckBox("Refresh all items")
+        full_refresh_layout = QHBoxLayout()
+        full_refresh_layout.addStretch()
+        full_refresh_layout.addWidget(full_refresh_checkbox)
+        # Checked, an import that was cancelled or failed carries on where it stopped
+        resume_checkbox = QCheckBox("Resume the last import")
+        resume_checkbox.setChecked(True)
+        full_refresh_layout.addWidget(resume_checkbox)
+        full_refresh_layout.addStretch()
+        layout.addLayout(full_refresh_layout)
+
         log_output = QTextEdit()
         log_output.setReadOnly(True)
         layout.addWidget(log_output)
@@ -1370,6 +1426,12 @@ class CollectionViewer(QMainWindow):
         import_button.setStyleSheet(get_default_button_stylesheet())
         layout.addWidget(import_button)
 
+        # Seeds the collection from a CSV export or saved release JSON, or refreshes
+        # it from a Discogs data dump, without the API
+        file_import_button = QPushButton("Import from File...")
+        file_import_button.setStyleSheet(get_default_button_stylesheet())
+        layout.addWidget(file_import_button)
+
         # --- Helper functions to enable/disable all tabs and adjust Escape key ---
         def disable_tabs_and_escape():
             tab_widget = self.centralWidget()
@@ -1397,9 +1459,22 @@ class CollectionViewer(QMainWindow):
                 log_output.append(f"Authentication failed: {e}")
                 return
 
+            start_worker(CollectionViewer.DiscogsImportWorker(
+                client, self.cfg, self.image_manifest, full_refresh=full_refresh_checkbox.isChecked(),
+                resume=resume_checkbox.isChecked()))
+
+        def run_file_import():
+            path, _ = QFileDialog.getOpenFileName(
+                self, "Import from File", "", "Discogs exports (*.csv *.json);;Discogs data dumps (*.xml.gz *.xml);;All files (*)")
+            if not path:
+                return
+            log_output.clear()
+            start_worker(CollectionViewer.DiscogsFileImportWorker(path, self.cfg))
+
+        def start_worker(worker):
             import_button.setText("Cancel Import")
+            file_import_button.setEnabled(False)
 
-            worker = CollectionViewer.DiscogsImportWorker(client, self.cfg)
             self.worker = worker  # keep reference
             self.import_thread = QThread()
             worker.moveToThread(self.import_thread)
@@ -1414,8 +1489,11 @@ class CollectionViewer(QMainWindow):
                 import_button.setText("Import from Discogs")
                 import_button.setEnabled(True)
                 import_button.setStyleSheet(get_default_button_stylesheet())
+                file_import_button.setEnabled(True)
                 enable_tabs_and_escape()
             worker.finished.connect(restore_import_button)
+            # Imported artwork may replace files that are already cached
+            worker.finished.connect(self.thumbnails.clear)
             worker.finished.connect(self.refresh_views)
 
             self.import_thread.started.connect(worker.run)
@@ -1436,6 +1514,7 @@ class CollectionViewer(QMainWindow):
                     import_button.setStyleSheet(get_default_button_stylesheet())
 
         import_button.clicked.connect(lambda: on_import_button_clicked())
+        file_import_button.clicked.connect(run_file_import)
         return widget
 
     def create_musicbrainz_matcher_tab(self):
@@ -1519,6 +1598,8 @@ class CollectionViewer(QMainWindow):
                     )
                 except Exception as e:
                     self.progress_msg.emit(f"Error: {e}")
+                finally:
+                    close_thread_connections()
                 self.finished.emit()
 
         def run_match(cancel=False):
@@ -0,0 +1,288 @@
+import os
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from shared.thumbnails import read_scaled_image, TABLE_THUMBNAIL_SIZE, DETAIL_THUMBNAIL_SIZE
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+# Thumbnails written next to the original artwork, one folder per size
+THUMBNAIL_SIZES = (TABLE_THUMBNAIL_SIZE, DETAIL_THUMBNAIL_SIZE)
+THUMBNAIL_QUALITY = 85
+
+# Images are spread over 256 subfolders named by a hash of the discogs_id, so
+# no folder holds more than a small fraction of the collection
+SHARD_LENGTH = 2
+
+
+def shard(discogs_id):
+    return hashlib.md5(str(discogs_id).encode()).hexdigest()[:SHARD_LENGTH]
+
+
+def image_path(images_folder, discogs_id):
+    return os.path.join(images_folder, shard(discogs_id), f"{discogs_id}.jpg")
+
+
+def thumbnail_folder(images_folder, size):
+    return os.path.join(images_folder, 'thumbnails', str(size))
+
+
+def thumbnail_path(images_folder, discogs_id, size):
+    return os.path.join(thumbnail_folder(images_folder, size), shard(discogs_id), f"{discogs_id}.jpg")
+
+
+def _discogs_id(file_name):
+    stem, ext = os.path.splitext(file_name)
+    return int(stem) if ext == '.jpg' and stem.isdigit() else None
+
+
+def _is_shard(name):
+    return len(name) == SHARD_LENGTH and all(c in '0123456789abcdef' for c in name)
+
+
+def scan_folder(folder):
+    """Return the discogs_ids with an image in a sharded folder, as (sharded, flat)
+
+    flat holds the images left at the top of the folder by the layout used
+    before sharding, which move_flat_images() moves into their shards."""
+
+    ids = set()
+    flat_ids = set()
+    if not os.path.isdir(folder):
+        return ids, flat_ids
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir() and _is_shard(entry.name):
+                with os.scandir(entry.path) as shard_entries:
+                    for shard_entry in shard_entries:
+                        discogs_id = _discogs_id(shard_entry.name)
+                        if discogs_id is not None:
+                            ids.add(discogs_id)
+            elif entry.is_file():
+                discogs_id = _discogs_id(entry.name)
+                if discogs_id is not None:
+                    flat_ids.add(discogs_id)
+
+    return ids, flat_ids
+
+
+def move_flat_images(folder, flat_ids):
+    """Move images from the top of a folder into their shards and return the discogs_ids moved"""
+    moved = set()
+    for discogs_id in flat_ids:
+        source = os.path.join(folder, f"{discogs_id}.jpg")
+        target = os.path.join(folder, shard(discogs_id), f"{discogs_id}.jpg")
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+        except OSError as e:
+            logger.warning(f"Could not move {source} into its shard: {e}")
+            continue
+        moved.add(discogs_id)
+    return moved
+
+
+class UnreadableImageError(OSError):
+    """Raised by write_thumbnails when a release's artwork cannot be decoded"""
+
+
+def write_thumbnails(images_folder, discogs_id, sizes=THUMBNAIL_SIZES):
+    """Write the thumbnails of a release's artwork, replacing any already there
+
+    Runs in a worker process. Each file is written under a temporary name and
+    moved into place, so a reader never sees a partial thumbnail. Returns the
+    discogs_id. Raises UnreadableImageError if the artwork cannot be decoded,
+    and OSError if a thumbnail cannot be written."""
+
+    source = image_path(images_folder, discogs_id)
+    for size in sizes:
+        image = read_scaled_image(source, size)
+        if image.isNull():
+            raise UnreadableImageError(f"Could not read {source}")
+
+        target = thumbnail_path(images_folder, discogs_id, size)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.tmp"
+        if not image.save(temp_path, 'JPEG', THUMBNAIL_QUALITY):
+            raise OSError(f"Could not write {target}")
+        os.replace(temp_path, target)
+    return discogs_id
+
+
+class ImageManifest:
+    """The artwork and thumbnails on disk, held in memory
+
+    Built with one scandir pass over the images folder, then kept up to date
+    by whoever writes images, so the views can look up a release's artwork
+    without touching the filesystem. Images still in the flat layout are
+    looked up where they are until shard_flat_images() moves them, which the
+    importer does off the GUI thread. The import thread, the thumbnail
+    generator's callbacks and the GUI all use the manifest, so its sets are
+    only touched under a lock."""
+
+    def __init__(self, images_folder, sizes=THUMBNAIL_SIZES):
+        self.images_folder = images_folder
+        self.sizes = sizes
+        self._lock = threading.Lock()
+        self._images = set()
+        self._flat_images = set()
+        self._thumbnails = {}
+        self._flat_thumbnails = {}
+        self.scan()
+
+    def _folders(self):
+        # (folder, sharded ids, flat ids) of the artwork and of each thumbnail size
+        yield self.images_folder, self._images, self._flat_images
+        for size in self.sizes:
+            yield (thumbnail_folder(self.images_folder, size),
+                   self._thumbnails.setdefault(size, set()), self._flat_thumbnails.setdefault(size, set()))
+
+    def scan(self):
+        images, flat_images = scan_folder(self.images_folder)
+        thumbnails = {}
+        flat_thumbnails = {}
+        for size in self.sizes:
+            thumbnails[size], flat_thumbnails[size] = scan_folder(thumbnail_folder(self.images_folder, size))
+        with self._lock:
+            self._images, self._flat_images = images, flat_images
+            self._thumbnails, self._flat_thumbnails = thumbnails, flat_thumbnails
+
+    def shard_flat_images(self):
+        """Move the images still in the flat layout into their shards and return how many were moved"""
+        with self._lock:
+            folders = [(folder, ids, flat_ids, set(flat_ids)) for folder, ids, flat_ids in self._folders()]
+
+        count = 0
+        for folder, ids, flat_ids, to_move in folders:
+            # The files are moved outside the lock, so lookups go on meanwhile
+            moved = move_flat_images(folder, to_move)
+            with self._lock:
+                ids.update(moved)
+                flat_ids.difference_update(moved)
+            count += len(moved)
+        return count
+
+    def has_image(self, discogs_id):
+        with self._lock:
+            return discogs_id in self._images or discogs_id in self._flat_images
+
+    def has_thumbnail(self, discogs_id, size):
+        with self._lock:
+            return (discogs_id in self._thumbnails.get(size, ())
+                    or discogs_id in self._flat_thumbnails.get(size, ()))
+
+    def add_image(self, discogs_id):
+        with self._lock:
+            self._images.add(discogs_id)
+
+    def add_thumbnails(self, discogs_id, sizes=None):
+        with self._lock:
+            for size in sizes or self.sizes:
+                self._thumbnails.setdefault(size, set()).add(discogs_id)
+
+    def image_path(self, discogs_id):
+        """Return the path of a release's artwork, or None if there is none"""
+        with self._lock:
+            if discogs_id in self._images:
+                return image_path(self.images_folder, discogs_id)
+            if discogs_id in self._flat_images:
+                return os.path.join(self.images_folder, f"{discogs_id}.jpg")
+        return None
+
+    def thumbnail_path(self, discogs_id, size):
+        """Return the path of a release's thumbnail, or None if there is none"""
+        with self._lock:
+            if discogs_id in self._thumbnails.get(size, ()):
+                return thumbnail_path(self.images_folder, discogs_id, size)
+            if discogs_id in self._flat_thumbnails.get(size, ()):
+                return os.path.join(thumbnail_folder(self.images_folder, size), f"{discogs_id}.jpg")
+        return None
+
+    def missing_thumbnails(self):
+        """Return the discogs_ids whose artwork has no thumbnail of some size"""
+        with self._lock:
+            images = self._images | self._flat_images
+            missing = set()
+            for size in self.sizes:
+                missing.update(images - self._thumbnails.get(size, set()) - self._flat_thumbnails.get(size, set()))
+        return sorted(missing)
+
+
+class ThumbnailGenerator:
+    """Generates thumbnails across a pool of worker processes
+
+    submit() queues a release whose artwork has just been written, close()
+    waits for the queue to drain and cancel() drops it. A manifest, if given,
+    is told about each release's thumbnails as soon as they are written. The
+    releases whose artwork could not be decoded are collected in unreadable,
+    for the caller to record. Workers are started with spawn, as forking a process that is running Qt
+    threads is not safe."""
+
+    def __init__(self, images_folder, callback=print, max_workers=None, manifest=None):
+        self.images_folder = images_folder
+        self.callback = callback
+        self.manifest = manifest
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._futures = {}
+        self.unreadable = []
+
+    def submit(self, discogs_id):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        future = self._executor.submit(write_thumbnails, self.images_folder, discogs_id)
+        if self.manifest is not None:
+            future.add_done_callback(self._on_written)
+        self._futures[future] = discogs_id
+
+    def _on_written(self, future):
+        # Runs on the executor's thread as each release's thumbnails are done
+        if not future.cancelled() and future.exception() is None:
+            self.manifest.add_thumbnails(future.result())
+
+    def close(self):
+        """Wait for the queued thumbnails and return how many were written"""
+        written = 0
+        if self._executor is None:
+            return written
+
+        for future, discogs_id in self._futures.items():
+            try:
+                future.result()
+                written += 1
+            except UnreadableImageError as e:
+                self.unreadable.append(discogs_id)
+                self.callback(f"Warning: Failed to generate thumbnails: {e}")
+            except Exception as e:
+                self.callback(f"Warning: Failed to generate thumbnails: {e}")
+        self._futures = {}
+        self._executor.shutdown()
+        self._executor = None
+        return written
+
+    def cancel(self):
+        """Drop the queued thumbnails without waiting for those being written
+
+        Releases whose thumbnails are dropped keep their artwork, so the next
+        import generates them as missing thumbnails."""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.cancel()
@@ -31,17 +31,18 @@ def missing(config: config.AppConfig):
         query.append('FROM discogs_releases d')
         query.append('LEFT JOIN mb_matches m USING(discogs_id)')
         query.append('WHERE m.mbid IS NULL')
-        if find_string:
-            query.append(f'AND (d.artist LIKE "%{find_string}%"')
-            query.append(f'OR d.title LIKE "%{find_string}%"')
-            query.append(f'OR d.sort_name LIKE "%{find_string}%")')
+        params = []
+        find_query = db.fts_match_query(find_string)
+        if find_query:
+            query.append(f'AND {db.fts_filter_sql("d")}')
+            params.append(find_query)
         if format_string:
             query.append(f'AND d.format LIKE "%{format_string}%"')
         query.append('ORDER BY d.sort_name, d.release_date, d.title, d.discogs_id')
 
         query_string = ' '.join(query)
 
-        cur.execute(query_string)
+        cur.execute(query_string, params)
 
         rows = cur.fetchall()
         if len(rows) == 0:
@@ -112,10 +113,11 @@ def list(config: config.AppConfig, order_by_date: bool = False):
         query.append('FROM discogs_releases d')
         query.append('LEFT JOIN mb_matches m USING(discogs_id)')
         query.append('WHERE TRUE')
-        if config.find:
-            query.append(f'AND (d.artist LIKE "%{config.find}%"')
-            query.append(f'OR d.title LIKE "%{config.find}%"')
-            query.append(f'OR d.sort_name LIKE "%{config.find}%")')
+        params = []
+        find_query = db.fts_match_query(config.find)
+        if find_query:
+            query.append(f'AND {db.fts_filter_sql("d")}')
+            params.append(find_query)
         if config.format:
             query.append(f'AND d.format LIKE "%{config.format}%"')
         if config.undated:
@@ -127,7 +129,7 @@ def list(config: config.AppConfig, order_by_date: bool = False):
         else:
             query.append('ORDER BY d.sort_name, d.release_date, d.title, d.discogs_id')
 
-        cur.execute(' '.join(query))
+        cur.execute(' '.join(query), params)
 
         items = cur.fetchall()
         if len(items) == 0:
@@ -196,7 +198,7 @@ def status(config: config.AppConfig):
         print(f'{fls(label, 45)}: {value}')
 
     discogs_client, discogs_access_token, discogs_access_secret = discogs_importer.connect_to_discogs(
-        config)
+        config.db_path)
 
     # fetch the identity object for the current logged in user.
     discogs_user = discogs_client.identity()
@@ -305,16 +307,17 @@ def random_selection(config: config.AppConfig):
         query.append('FROM discogs_releases d')
         query.append('LEFT JOIN mb_matches m USING(discogs_id)')
         query.append('WHERE TRUE')
-        if config.find:
-            query.append(f'AND (d.artist LIKE "%{config.find}%"')
-            query.append(f'OR d.title LIKE "%{config.find}%"')
-            query.append(f'OR d.sort_name LIKE "%{config.find}%")')
+        params = []
+        find_query = db.fts_match_query(config.find)
+        if find_query:
+            query.append(f'AND {db.fts_filter_sql("d")}')
+            params.append(find_query)
         if config.format:
             query.append(f'AND d.format LIKE "%{config.format}%"')
         query.append('ORDER BY RANDOM()')
         query.append('LIMIT 1')
 
-        cur.execute(' '.join(query))
+        cur.execute(' '.join(query), params)
 
         item = cur.fetchone()
 
@@ -335,16 +338,17 @@ def on_this_day(today_str='', config: config.AppConfig = None):
         query.append('FROM discogs_releases d')
         query.append('LEFT JOIN mb_matches m USING(discogs_id)')
         query.append('WHERE d.release_date IS NOT NULL')
-        if config.find:
-            query.append(f'AND (d.artist LIKE "%{config.find}%"')
-            query.append(f'OR d.title LIKE "%{config.find}%"')
-            query.append(f'OR d.sort_name LIKE "%{config.find}%")')
+        params = []
+        find_query = db.fts_match_query(config.find)
+        if find_query:
+            query.append(f'AND {db.fts_filter_sql("d")}')
+            params.append(find_query)
         if config.format:
             query.append(f'AND d.format LIKE "%{config.format}%"')
         query.append(
             'ORDER BY length(d.release_date) DESC, d.release_date, d.sort_name, d.title, d.discogs_id')
 
-        cur.execute(' '.join(query))
+        cur.execute(' '.join(query), params)
 
         items = cur.fetchall()
 
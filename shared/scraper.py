@@ -9,7 +9,7 @@ from webdriver_manager.chrome import ChromeDriverManager
 import dateparser
 import logging
 
-from discogs import db_discogs
+from discogs import db_discogs, discogs_importer
 from shared import utils, db
 
 logger = logging.getLogger(__name__)
@@ -101,7 +101,9 @@ def scrape_row(db_path, discogs_client, discogs_id=0):
 
 
 def scrape_discogs(db_path):
-    discogs_client, *_ = db_discogs.connect_to_discogs(db_path)
+    # The client's response cache is shared with the importer, so release
+    # JSON fetched by a recent import is not downloaded again
+    discogs_client, *_ = discogs_importer.connect_to_discogs(db_path)
     with db.context_manager() as cur:
         cur.execute("SELECT * FROM discogs_releases ORDER BY sort_name, discogs_id")
         rows = cur.fetchall()
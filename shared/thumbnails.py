@@ -0,0 +1,136 @@
+from collections import OrderedDict
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader, QPixmap
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+# Thumbnail edge lengths used by the views
+TABLE_THUMBNAIL_SIZE = 100
+DETAIL_THUMBNAIL_SIZE = 400
+
+
+def read_scaled_image(path, size):
+    """Decode an image file scaled to fit within size x size
+
+    QImageReader scales while decoding (for JPEG, in the decoder itself), so
+    the full-size image is never held in memory. Returns a null QImage if the
+    file cannot be read."""
+    reader = QImageReader(path)
+    original_size = reader.size()
+    if original_size.isValid():
+        reader.setScaledSize(original_size.scaled(QSize(size, size), Qt.AspectRatioMode.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        logger.debug(f"Could not read image {path}: {reader.errorString()}")
+    return image
+
+
+class _ThumbnailSignals(QObject):
+    # QRunnable is not a QObject, so results are delivered through this
+    decoded = pyqtSignal(str, int, QImage)
+
+
+class _ThumbnailTask(QRunnable):
+    def __init__(self, path, size, signals):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.signals = signals
+        # Whoever asked for the decode; it is dequeued once none of them want it
+        self.owners = set()
+        # The service keeps the task until it is decoded or taken off the queue
+        self.setAutoDelete(False)
+
+    def run(self):
+        self.signals.decoded.emit(self.path, self.size, read_scaled_image(self.path, self.size))
+
+
+class ThumbnailService(QObject):
+    """Decodes thumbnails on a thread pool and keeps the results in an LRU
+
+    request() returns a cached pixmap straight away, or queues the decode and
+    emits thumbnail_ready when it is done. The cache is shared by every view
+    and is bounded by the total size of the pixmaps it holds. A queued decode
+    is shared by everyone who requests it, and is only taken off the queue
+    when each of them has cancelled it."""
+
+    thumbnail_ready = pyqtSignal(str, int, QPixmap)
+
+    def __init__(self, parent=None, max_bytes=64 * 1024 * 1024, max_threads=None):
+        super().__init__(parent)
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._pending = {}
+        self._unreadable = set()
+
+        self._pool = QThreadPool(self)
+        if max_threads:
+            self._pool.setMaxThreadCount(max_threads)
+
+        self._signals = _ThumbnailSignals()
+        self._signals.decoded.connect(self._on_decoded)
+
+    def cached(self, path, size):
+        key = (path, size)
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self._cache.move_to_end(key)
+        return pixmap
+
+    def request(self, path, size, owner=None):
+        """Return the thumbnail if cached, otherwise start decoding it for owner and return None"""
+        pixmap = self.cached(path, size)
+        if pixmap is not None:
+            return pixmap
+
+        key = (path, size)
+        if key in self._unreadable:
+            return None
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = _ThumbnailTask(path, size, self._signals)
+            self._pool.start(task)
+        task.owners.add(owner)
+        return None
+
+    def cancel(self, path, size, owner=None):
+        """Withdraw owner's request, dequeuing the decode if nobody else wants it and it has not started"""
+        key = (path, size)
+        task = self._pending.get(key)
+        if task is None:
+            return
+        task.owners.discard(owner)
+        # A decode that is already running stays pending and delivers its result
+        if not task.owners and self._pool.tryTake(task):
+            del self._pending[key]
+
+    def clear(self):
+        self._cache.clear()
+        self._cache_bytes = 0
+        self._unreadable.clear()
+
+    def _store(self, path, size, image):
+        pixmap = QPixmap.fromImage(image)
+        key = (path, size)
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_bytes -= old.width() * old.height() * old.depth() // 8
+        self._cache[key] = pixmap
+        self._cache_bytes += pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+        while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= evicted.width() * evicted.height() * evicted.depth() // 8
+        return pixmap
+
+    def _on_decoded(self, path, size, image):
+        self._pending.pop((path, size), None)
+        if image.isNull():
+            self._unreadable.add((path, size))
+            return
+        self.thumbnail_ready.emit(path, size, self._store(path, size, image))
@@ -2,7 +2,7 @@
 
 # Shared helper functions
 
-from functools import wraps
+from functools import wraps, lru_cache
 import time
 import datetime
 import re
@@ -262,6 +262,7 @@ def pluralize(count, singular, plural=None):
     return f"{count} {singular}" if count == 1 else f"{count} {plural}"
 
 
+@lru_cache(maxsize=4096)
 def parse_and_humanize_date(ymd_date):
     if not ymd_date:
         return ''
@@ -284,6 +285,7 @@ def parse_and_humanize_date(ymd_date):
     return ''
 
 
+@lru_cache(maxsize=4096)
 def humanize_date_delta(dt1, dt2=datetime.date.today()):
     def build_parts(rd, fields):
         label_map = {
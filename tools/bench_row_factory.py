@@ -0,0 +1,67 @@
+# tools/bench_row_factory.py
+#
+# Micro-benchmark for shared.db.namedtuple_factory: fetches every row of a
+# generated discogs_releases table with the old per-row namedtuple factory
+# and with the cached one. Run from the repository root:
+#
+#     python tools/bench_row_factory.py [rows]
+
+from collections import namedtuple
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.db import CREATE_DISCOGS_RELEASES_TABLE, namedtuple_factory  # noqa: E402
+
+
+def uncached_namedtuple_factory(cursor, row):
+    # The factory as it was before row classes were cached
+    return namedtuple("Row", [column[0] for column in cursor.description])(*row)
+
+
+def build_database(row_count):
+    conn = sqlite3.connect(":memory:")
+    conn.execute(CREATE_DISCOGS_RELEASES_TABLE)
+    conn.executemany("""
+        INSERT INTO discogs_releases (discogs_id, artist, title, year, barcodes, catnos, country, format,
+                                      master_id, release_date, sort_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        (i, f"Artist {i % 5000}", f"Title {i}", 1960 + i % 60, f"{i:013d}", f"CAT-{i}", "UK",
+         'Vinyl: 7", 45 RPM, Single', i // 3, f"{1960 + i % 60}-{1 + i % 12:02}-{1 + i % 28:02}",
+         f"Artist {i % 5000}")
+        for i in range(1, row_count + 1)
+    ))
+    conn.commit()
+    return conn
+
+
+def time_fetch(conn, row_factory, repeat=3):
+    best = None
+    for _ in range(repeat):
+        cur = conn.cursor()
+        cur.row_factory = row_factory
+        start = time.perf_counter()
+        cur.execute("SELECT * FROM discogs_releases")
+        rows = cur.fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(rows)
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    conn = build_database(row_count)
+
+    for label, factory in (("tuple (no factory)", None),
+                           ("namedtuple, class per row", uncached_namedtuple_factory),
+                           ("namedtuple, cached class", namedtuple_factory)):
+        elapsed, rows = time_fetch(conn, factory)
+        print(f"{label:28} {rows} rows in {elapsed:.3f}s ({rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()